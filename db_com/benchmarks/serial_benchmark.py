@@ -0,0 +1,377 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is the Serial benchmark module.
+
+This module measures the receive and query paths of Serial over a
+VirtualDevice pty loopback and writes a JSON report, so versions can be
+compared.
+
+  $ python -m db_com.benchmarks.serial_benchmark --output report.json
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+
+from db_com.communications.db_serial import Serial
+from db_com.communications.virtual_device import VirtualDevice
+from db_com.communications.wire_trace import WireTrace
+
+LINE = b'[   12.345678] benchmark firmware log line 0123456789 abcdefghij'
+PROMPT = 'PROMPT>'
+SIZES = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Return dict of nearest-rank percentiles, min and max of samples."""
+    ordered = sorted(samples)
+    result = {'min': ordered[0], 'max': ordered[-1]}
+    for point in points:
+        rank = max(0, int(round(point / 100.0 * len(ordered))) - 1)
+        result['p{}'.format(point)] = ordered[rank]
+
+    return result
+
+
+def parse_size(text):
+    """Parse a size such as 1K, 1M or 100M to bytes."""
+    text = text.strip().upper()
+    if text[-1:] in SIZES:
+        return int(float(text[:-1]) * SIZES[text[-1]])
+    return int(text)
+
+
+def bench_reader(lines, bytes_mode=False, trace=False):
+    """Bytes per second delivered by the read thread to the read handler.
+
+    Args:
+      lines: The number of lines streamed.
+      bytes_mode: The bytes mode of the Serial.
+      trace: Whether a WireTrace is enabled.
+    Returns:
+      dict of the measurement.
+    """
+    received = [0, 0]
+    done = threading.Event()
+
+    def handler(data):
+        received[0] += 1
+        received[1] += len(data)
+        if received[0] == lines:
+            done.set()
+
+    with VirtualDevice() as device:
+        serial_port = Serial(device.port, 115200, bytes_mode=bytes_mode,
+                             read_handler=handler)
+        if trace:
+            serial_port.trace = WireTrace()
+        serial_port.open()
+        start = time.perf_counter()
+        device.stream([LINE], repeat=lines)
+        done.wait(60)
+        elapsed = time.perf_counter() - start
+        serial_port.close()
+
+    return {'lines': received[0], 'bytes': received[1], 'seconds': elapsed,
+            'bytes_per_second': received[1] / elapsed,
+            'lines_per_second': received[0] / elapsed}
+
+
+class _FormattingFilter(logging.Filter):
+    """Filter formatting every record, as the application filters do."""
+
+    def filter(self, record):
+        record.getMessage()
+        return True
+
+
+def bench_trace(calls):
+    """Cost per received line of the wire logging, in nanoseconds.
+
+    Compares the logging.debug call the receive loop used to make, with
+    debug output handled and filtered or disabled, to WireTrace enabled and
+    disabled.
+
+    Args:
+      calls: The number of lines traced.
+    Returns:
+      dict of nanoseconds per line.
+    """
+    line = str(LINE, 'utf-8')
+    data = LINE + b'\r\n'
+    root = logging.getLogger()
+    level, handlers = root.level, root.handlers
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.addFilter(_FormattingFilter())
+    result = {}
+
+    def measure(function):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        return (time.perf_counter() - start) / calls * 1e9
+
+    def log_line():
+        logging.debug('read : {}'.format(line))
+
+    # Only the benchmark handler, whatever the application configured.
+    root.handlers = [handler]
+    try:
+        root.setLevel(logging.DEBUG)
+        result['logging_debug'] = measure(log_line)
+        root.setLevel(logging.WARNING)
+        result['logging_disabled'] = measure(log_line)
+    finally:
+        root.handlers = handlers
+        root.setLevel(level)
+        handler.stream.close()
+
+    for name, trace in (('trace_disabled', None),
+                        ('trace_enabled', WireTrace())):
+        def trace_line():
+            if trace is not None:
+                trace.record(data)
+        result[name] = measure(trace_line)
+
+    return result
+
+
+def bench_read(lines):
+    """Bytes per second returned by consecutive Serial.read calls.
+
+    Args:
+      lines: The number of lines streamed.
+    Returns:
+      dict of the measurement.
+    """
+    count = total = 0
+    with VirtualDevice() as device:
+        serial_port = Serial(device.port, 115200, timeout=1)
+        serial_port.open()
+        start = time.perf_counter()
+        device.stream([LINE], repeat=lines)
+        while count < lines:
+            data = serial_port.read()
+            if not data:
+                break
+            count += 1
+            total += len(data)
+        elapsed = time.perf_counter() - start
+        serial_port.close()
+
+    return {'lines': count, 'bytes': total, 'seconds': elapsed,
+            'bytes_per_second': total / elapsed,
+            'lines_per_second': count / elapsed}
+
+
+def bench_query(iterations):
+    """Round-trip latency of query and query_until.
+
+    Args:
+      iterations: The number of round trips of each.
+    Returns:
+      dict of latency percentiles in seconds.
+    """
+    result = {}
+    responses = [(r'^AT$', 'OK'), (r'^ATI$', ['Model', 'Revision', 'OK'])]
+    with VirtualDevice(responses=responses) as device:
+        serial_port = Serial(device.port, 115200, timeout=2)
+        serial_port.open()
+
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            serial_port.query('AT')
+            samples.append(time.perf_counter() - start)
+        result['query'] = percentiles(samples)
+
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            serial_port.query_until('ATI', 'OK')
+            samples.append(time.perf_counter() - start)
+        result['query_until'] = percentiles(samples)
+
+        serial_port.close()
+
+    return result
+
+
+def bench_read_until(size):
+    """Time read_until takes to find a terminator after size bytes.
+
+    Args:
+      size: The number of bytes streamed before the terminator.
+    Returns:
+      dict of the measurement.
+    """
+    line = LINE + b'\r\n'
+    repeat = max(1, size // len(line))
+    with VirtualDevice() as device:
+        serial_port = Serial(device.port, 115200, timeout=600)
+        serial_port.open()
+
+        def produce():
+            device.stream([LINE], repeat=repeat).join()
+            device.send(PROMPT)
+
+        producer = threading.Thread(target=produce)
+        start = time.perf_counter()
+        producer.start()
+        response = serial_port.read_until(PROMPT)
+        elapsed = time.perf_counter() - start
+        producer.join()
+        serial_port.close()
+
+    return {'bytes': len(response), 'found': response.endswith(PROMPT),
+            'seconds': elapsed, 'bytes_per_second': len(response) / elapsed}
+
+
+def bench_abort(iterations, delay=0.05):
+    """How late read_until returns after its timeout or force_abort.
+
+    Args:
+      iterations: The number of reads of each.
+      delay: The timeout, and the time after which force_abort turns true.
+    Returns:
+      dict of overshoot percentiles in seconds.
+    """
+    result = {}
+    with VirtualDevice() as device:
+        serial_port = Serial(device.port, 115200)
+        serial_port.open()
+
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            serial_port.read_until(PROMPT, timeout=delay)
+            samples.append(time.perf_counter() - start - delay)
+        result['timeout'] = percentiles(samples)
+
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            abort_time = start + delay
+            serial_port.read_until(
+                PROMPT, timeout=60,
+                force_abort=lambda: time.perf_counter() >= abort_time)
+            samples.append(time.perf_counter() - abort_time)
+        result['force_abort'] = percentiles(samples)
+
+        serial_port.close()
+
+    return result
+
+
+def bench_pacing(length=200, gap=0.001):
+    """Timing of a command written with wait_between_characters, against
+    a sleep per character on the caller thread.
+
+    Args:
+      length: The characters of the command.
+      gap: The seconds between characters.
+    Returns:
+      dict of the seconds taken, the error against the ideal time and the
+      pacing jitter in seconds.
+    """
+    result = {}
+    command = 'A' * length
+    # The terminal character is paced too.
+    ideal = length * gap
+    with VirtualDevice() as device:
+        serial_port = Serial(device.port, 115200)
+        serial_port.open()
+
+        start = time.perf_counter()
+        for char in command:
+            serial_port.session.write(bytes(char, 'utf-8'))
+            time.sleep(gap)
+        elapsed = time.perf_counter() - start
+        result['sleep_loop'] = {'seconds': elapsed, 'error': elapsed - ideal}
+
+        start = time.perf_counter()
+        serial_port.write(command, wait_between_characters=gap)
+        elapsed = time.perf_counter() - start
+        result['paced'] = {'seconds': elapsed, 'error': elapsed - ideal,
+                           'jitter': serial_port.stats.pacing_jitter.snapshot()}
+
+        serial_port.close()
+
+    return result
+
+
+def run(lines=100000, iterations=200, sizes=('1K', '1M', '100M')):
+    """Run every benchmark.
+
+    Args:
+      lines: The number of lines streamed for throughput.
+      iterations: The number of round trips for latency.
+      sizes: The stream sizes for read_until.
+    Returns:
+      dict of the results.
+    """
+    results = {
+        'reader': bench_reader(lines),
+        'reader_bytes_mode': bench_reader(lines, bytes_mode=True),
+        'reader_traced': bench_reader(lines, trace=True),
+        'trace': bench_trace(lines),
+        'read': bench_read(lines),
+        'latency': bench_query(iterations),
+        'abort': bench_abort(max(1, iterations // 10)),
+        'pacing': bench_pacing(),
+        'read_until': {},
+    }
+    for size in sizes:
+        results['read_until'][size] = bench_read_until(parse_size(size))
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serial benchmark over a '
+                                                 'pty loopback.')
+    parser.add_argument('--output', help='JSON report file, default stdout')
+    parser.add_argument('--label', default='', help='version label')
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--sizes', default='1K,1M,100M',
+                        help='read_until stream sizes')
+    args = parser.parse_args(argv)
+
+    report = {
+        'label': args.label,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': run(args.lines, args.iterations, args.sizes.split(',')),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if '__main__' == __name__:
+    main()
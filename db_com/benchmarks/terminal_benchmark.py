@@ -0,0 +1,127 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is the terminal benchmark module.
+
+This module appends lines to the terminal scrollback in batches, as the
+terminal view does, and samples the resident memory of the process, so it
+can be checked that memory stays flat once the scrollback is full. The
+batches go through TerminalModel when PySide2 is installed, else straight
+to the LineStore the same way. The exit status is 1 when memory grows more
+than --max-growth after the first sample.
+
+  $ python -m db_com.benchmarks.terminal_benchmark --lines 10000000
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+from db_com.user_interface.line_store import LineStore
+
+try:
+    from db_com.user_interface.terminal_view import TerminalModel
+except ImportError:
+    TerminalModel = None
+
+LINE = b'[   12.345678] benchmark firmware log line 0123456789 abcdefghij'
+MEGABYTE = 1024 * 1024
+
+
+def rss():
+    """Return the resident memory of the process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # The peak is all there is, ru_maxrss is in bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def bench_scrollback(lines, batch=100, samples=10):
+    """Resident memory and speed of appending lines to a full scrollback.
+
+    Args:
+      lines: The number of lines appended.
+      batch: The lines appended at once, as a coalesced UI update.
+      samples: The number of memory samples taken.
+    Returns:
+      dict of the lines per second, the memory samples in bytes and the
+      growth after the first sample.
+    """
+    store = LineStore()
+    if TerminalModel is not None:
+        append_lines = TerminalModel(store).append_lines
+    else:
+        def append_lines(batch_lines):
+            store.evictions(batch_lines)
+            for line in batch_lines:
+                store.append(line)
+
+    batch_lines = [LINE] * batch
+    every = max(1, lines // batch // samples)
+    memory = []
+    start = time.perf_counter()
+    for index in range(lines // batch):
+        append_lines(batch_lines)
+        if (index + 1) % every == 0:
+            memory.append(rss())
+    elapsed = time.perf_counter() - start
+
+    return {'lines': lines, 'model': TerminalModel is not None,
+            'seconds': elapsed, 'lines_per_second': lines / elapsed,
+            'kept': len(store), 'dropped': store.dropped, 'rss': memory,
+            'growth': memory[-1] - memory[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Terminal scrollback '
+                                                 'memory benchmark.')
+    parser.add_argument('--output', help='JSON report file, default stdout')
+    parser.add_argument('--label', default='', help='version label')
+    parser.add_argument('--lines', type=int, default=10000000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--max-growth', type=float, default=1.0,
+                        help='MB the memory may grow after the first sample')
+    args = parser.parse_args(argv)
+
+    result = bench_scrollback(args.lines, args.batch)
+    report = {
+        'label': args.label,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': {'scrollback': result},
+    }
+
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if result['growth'] > args.max_growth * MEGABYTE:
+        sys.exit(1)
+
+
+if '__main__' == __name__:
+    main()
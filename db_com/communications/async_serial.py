@@ -0,0 +1,421 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is an asyncio Serial communication module.
+
+This module has a class used to communicate via serial from an asyncio event
+loop, without a thread per port. The port file descriptor is watched by the
+event loop, so it only works where the loop supports add_reader on it, which
+means POSIX.
+
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import serial
+
+from db_com.communications.checksum import TaggedFrame
+from db_com.communications.db_serial import Serial, _QUEUED_HANDLERS
+from db_com.communications.matcher import MultiStreamMatcher, StreamMatcher
+from db_com.communications.recorder import DIRECTION_TX
+
+
+class AsyncSerial(Serial):
+    """Class provides coroutines to communicate with devices through Serial.
+
+    The constructor arguments and properties are the ones of Serial. open,
+    read, write, query, read_until, read_untils and query_until are
+    coroutines; close is a plain method.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Configure the driver initial values, see Serial."""
+        super(AsyncSerial, self).__init__(*args, **kwargs)
+        self._loop = None
+        self._fileno = None
+        self._data_waiter = None
+        self._paused = False
+        self._error = None
+
+    async def open(self):
+        """Open serial port connection and watch it on the running loop.
+
+        Args:
+          None.
+        Returns:
+          None.
+        Raises:
+          None.
+        """
+        self._loop = asyncio.get_event_loop()
+        self._session = self._create_session()
+        self._session.timeout = 0
+        self._session.open()
+        self._rx_buffer.clear()
+        self._paused = False
+        self._error = None
+        self._fileno = self._session.fileno()
+        if isinstance(self._read_handler, _QUEUED_HANDLERS):
+            self._read_handler.start()
+        self._loop.add_reader(self._fileno, self._on_readable)
+        logging.debug('Opened async serial connection to {}'.format(self.port))
+
+    def close(self):
+        """Close serial port connection.
+
+        Args:
+          None.
+        Returns:
+          None.
+        Raises:
+          None.
+        """
+        if self._session:
+            if self._fileno is not None:
+                self._loop.remove_reader(self._fileno)
+                self._fileno = None
+            self._wake(serial.SerialException('Port closed.'))
+            if isinstance(self._read_handler, _QUEUED_HANDLERS):
+                self._read_handler.stop()
+            if self._session.isOpen():
+                self._session.close()
+            self._session = None
+
+    async def read(self, timeout=None):
+        """Reads a line from the device.
+
+        Args:
+          timeout: The read timeout.
+        Returns:
+          read_buffer: The buffer read from device, bytes in bytes mode, or
+            the partial line on timeout, b'' with a binary framer.  In bytes
+            mode the frame after the frame filter.  Empty lines are skipped.
+        Raises:
+          serial.SerialException: The port failed or was closed.
+        """
+        deadline = self._deadline(timeout)
+        while True:
+            frame = self._next_frame()
+            while frame is not None:
+                read_buffer = self._result(frame)
+                if read_buffer:
+                    self._stats.lines_in += 1
+                    return read_buffer
+                frame = self._next_frame()
+            if not await self._wait_data(deadline):
+                if self._framed:
+                    return b''
+                return self._result(self._rx_buffer.take())
+
+    async def write(self, command, timeout=None, wait_between_characters=None):
+        """Writes data to the device.
+
+        Args:
+          command: The string command to be written.
+          timeout: The timeout for the connection.
+          wait_between_characters: The time to wait between each character in
+            the command to send.
+        Returns:
+          None.
+        Raises:
+          serial.SerialTimeoutException: The data could not be written in
+            time.
+        """
+        write_timeout = self._write_timeout
+        if timeout is not None:
+            write_timeout = timeout
+        deadline = self._loop.time() + write_timeout
+
+        data = bytes(command + self._write_terminal_character, 'utf-8')
+        if self._recorder is not None:
+            self._recorder.record(data, DIRECTION_TX)
+        if self._trace is not None:
+            self._trace.record(data, DIRECTION_TX)
+        self._stats.writes += 1
+        self._stats.bytes_out += len(data)
+        self._stats.lines_out += 1
+        if wait_between_characters is None:
+            await self._write_all(data, deadline)
+            return
+
+        for index in range(len(data)):
+            await self._write_all(data[index:index + 1], deadline)
+            await asyncio.sleep(wait_between_characters)
+
+    async def query(self, command, timeout=None, write_timeout=None,
+                    wait_between_commands=None, wait_between_characters=None):
+        """Writes to device and waits response.
+
+        Args:
+          command: The command that is sent to the device that generates a
+            response.
+          timeout: The timeout for reading from the connection.
+          write_timeout: The timeout for writing to the connection.
+          wait_between_commands: The time to wait between when the command is
+            sent and when the read occurs.
+          wait_between_characters: The time to wait between each character in
+            the command to send.
+        Returns:
+          The response from the device.
+        Raises:
+          None.
+        """
+        logging.debug('query : %s', command)
+        start = time.perf_counter()
+        await self.write(command, write_timeout,
+                         wait_between_characters=wait_between_characters)
+        if wait_between_commands is not None:
+            await asyncio.sleep(wait_between_commands)
+        response = await self.read(timeout=timeout)
+        self._stats.query_latency.record(time.perf_counter() - start)
+
+        return response
+
+    async def read_untils(self, read_until_list, timeout=None,
+                          force_abort=None):
+        """Reads info from device until the read_until_list is
+        reached or timeout has expired.
+
+        Args:
+          read_until_list: The expected list of strings from the device.
+          timeout: The timeout for the connection.
+          force_abort: The abort callback to force stop.
+        Returns:
+          response: Response from the device whether or not the
+            read_until_list is obtained
+        Raises:
+          None.
+        """
+        read_until_list = [self._encode(key) for key in read_until_list]
+
+        return await self._read_matched(MultiStreamMatcher(read_until_list),
+                                        timeout, force_abort)
+
+    async def read_until(self, read_until_string, timeout=None,
+                         force_abort=None):
+        """Reads info from device until the read_until_string is
+        reached or timeout has expired.
+
+        Args:
+          read_until_string: The expected string from the device.
+          timeout: The timeout for the connection.
+          force_abort: The abort callback to force stop.
+        Returns:
+          response: Response from the device whether or not the
+            read_until_string is obtained
+        Raises:
+          None.
+        """
+        return await self._read_matched(
+            StreamMatcher(self._encode(read_until_string)), timeout,
+            force_abort)
+
+    async def query_until(self, command, read_until_string, timeout=None,
+                          wait_between_commands=None,
+                          wait_between_characters=None, write_timeout=None):
+        """Writes to device, and reads response until read_until_string or
+        timeout has expired.
+
+        Args:
+          command: The command that is sent to the device that generates a
+            response.
+          read_until_string: The expected string from the device.
+          timeout: The timeout for reading from the connection.
+          wait_between_commands: The time to wait between when the command is
+            sent and when the read occurs.
+          wait_between_characters: The time to wait between each character in
+            the command to send.
+          write_timeout: The timeout for writing to the connection.
+        Returns:
+          Response from the device whether or not the read_until_string is
+            obtained.
+        Raises:
+          None.
+        """
+        logging.debug('query : %s, until %s', command, read_until_string)
+        start = time.perf_counter()
+        await self.write(command, write_timeout,
+                         wait_between_characters=wait_between_characters)
+        if wait_between_commands is not None:
+            await asyncio.sleep(wait_between_commands)
+        response = await self.read_until(read_until_string, timeout=timeout)
+        self._stats.query_latency.record(time.perf_counter() - start)
+
+        return response
+
+    async def _read_matched(self, matcher, timeout, force_abort=None):
+        """Reads until the matcher has seen its pattern or timeout has
+        expired, see Serial._read_matched.
+
+        Matching is done on the raw bytes, text mode decodes the response
+        once at the end.  Data after the pattern is left for the next read,
+        in text mode from the end of its line.  With a binary framer the
+        pattern is looked for inside each frame and the list of frames is
+        returned.  force_abort is polled every ABORT_INTERVAL seconds.
+        """
+        deadline = self._deadline(timeout)
+        chunks = []
+        consumed = 0
+        while not matcher.matched:
+            if force_abort is not None and force_abort():
+                if self._framed:
+                    return []
+                return b'' if self._bytes_mode else ''
+
+            if self._framed:
+                frame = self._next_frame()
+                if frame is not None:
+                    chunks.append(frame)
+                    matcher.reset()
+                    matcher.feed(frame.payload if isinstance(
+                        frame, TaggedFrame) else frame)
+                    continue
+            elif self._rx_buffer:
+                size = None
+                if matcher.feed(self._rx_buffer.peek()):
+                    size = self._match_end(matcher, consumed)
+                chunk = bytes(self._rx_buffer.take(size))
+                chunks.append(chunk)
+                consumed += len(chunk)
+                continue
+
+            wait_deadline = deadline
+            if force_abort is not None:
+                wait_deadline = min(deadline,
+                                    self._loop.time() + self.ABORT_INTERVAL)
+            if not await self._wait_data(wait_deadline) and \
+                    self._loop.time() >= deadline:
+                break
+
+        if self._framed:
+            return chunks
+        response = b''.join(chunks)
+        if self._bytes_mode:
+            return response
+        return self.decode(response)
+
+    def _on_readable(self):
+        """Event loop callback, drain the port into the receive buffer."""
+        try:
+            if not self._fill():
+                # The buffer is full, wait for a reader to consume it.
+                self._loop.remove_reader(self._fileno)
+                self._paused = True
+        except serial.SerialException as error:
+            logging.error('Serial read failed : {}'.format(error))
+            self._loop.remove_reader(self._fileno)
+            self._fileno = None
+            self._wake(error)
+            return
+
+        if self._read_handler:
+            self._deliver()
+            return
+        self._wake()
+
+    def _wake(self, error=None):
+        """Wake the coroutine waiting for data, if any."""
+        if error is not None:
+            self._error = error
+        if self._data_waiter is not None and not self._data_waiter.done():
+            self._data_waiter.set_result(None)
+
+    async def _wait_data(self, deadline):
+        """Wait until new data arrives or the deadline passes.
+
+        Returns:
+          True if new data arrived, False on timeout.
+        Raises:
+          serial.SerialException: The port failed or was closed.
+        """
+        if self._error is not None:
+            raise self._error
+        remaining = deadline - self._loop.time()
+        if remaining <= 0:
+            return False
+        if self._paused:
+            self._paused = False
+            self._loop.add_reader(self._fileno, self._on_readable)
+
+        self._data_waiter = self._loop.create_future()
+        try:
+            await asyncio.wait_for(self._data_waiter, remaining)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._data_waiter = None
+        if self._error is not None:
+            raise self._error
+
+        return True
+
+    async def _write_all(self, data, deadline):
+        """Write data without blocking, waiting for the port to drain."""
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self._fileno, view):]
+            except BlockingIOError:
+                pass
+            if not view:
+                break
+
+            remaining = deadline - self._loop.time()
+            writable = self._loop.create_future()
+            self._loop.add_writer(self._fileno, writable.set_result, None)
+            try:
+                await asyncio.wait_for(writable, max(remaining, 0))
+            except asyncio.TimeoutError:
+                raise serial.SerialTimeoutException('Write timeout')
+            finally:
+                self._loop.remove_writer(self._fileno)
+
+    def _deadline(self, timeout):
+        """Loop time at which a read with the given timeout expires."""
+        if timeout is None:
+            timeout = self._timeout
+        return self._loop.time() + timeout
+
+    def _result(self, data):
+        """Turn a frame from _next_frame or a line view into what read
+        returns, a TaggedFrame from the frame filter is returned as is."""
+        if self._bytes_mode:
+            return data if isinstance(data, TaggedFrame) else bytes(data)
+        return self.decode(data).strip(self._read_terminal_character)
+
+
+def qt_event_loop(application):
+    """Run asyncio on the Qt event loop, so AsyncSerial can be used from the
+    user interface.
+
+    Args:
+      application: The QApplication.
+    Returns:
+      loop: The event loop, already set as the current one.
+    Raises:
+      ImportError: The optional qasync package is not installed.
+    """
+    try:
+        import qasync
+    except ImportError:
+        raise ImportError('Running asyncio on Qt requires the qasync package.')
+
+    loop = qasync.QEventLoop(application)
+    asyncio.set_event_loop(loop)
+
+    return loop
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a broadcast hub module.
+
+This module has a class used to hand the data read by one Serial to many
+consumers, e.g. the terminal view, a recorder, a parser and a metrics tap.
+Each subscriber gets its own ReceiveQueue and dispatch thread, so a slow one
+only fills its own queue. Frames are made immutable bytes once and the same
+object is queued to every subscriber, never copied per subscriber.
+
+"""
+
+import itertools
+import logging
+import threading
+
+from db_com.communications.checksum import TaggedFrame
+from db_com.communications.receive_queue import ReceiveQueue, \
+    POLICY_DROP_OLDEST
+
+
+class Subscription(object):
+    """Class holds the filter and queue of one subscriber."""
+
+    def __init__(self, name, data_filter, receive_queue):
+        self.name = name
+        self.data_filter = data_filter
+        self.queue = receive_queue
+
+    def metrics(self):
+        """Return dict of the queue metrics of the subscriber."""
+        return self.queue.metrics()
+
+
+class BroadcastHub(object):
+    """Class fans the data read by a Serial out to subscribers.
+
+    An instance is used as the read_handler of Serial, which starts and
+    stops the subscriber queues with its read thread.
+    """
+
+    def __init__(self):
+        # Replaced, never changed in place, so the read thread iterates it
+        # without a lock.
+        self._subscriptions = ()
+        self._lock = threading.Lock()
+        self._running = False
+        self._numbers = itertools.count(2)
+
+    def __call__(self, data):
+        self.publish(data)
+
+    @property
+    def subscriptions(self):
+        """A property containing the tuple of Subscription."""
+        return self._subscriptions
+
+    def subscribe(self, handler, data_filter=None, maxsize=10000,
+                  policy=POLICY_DROP_OLDEST, name=None):
+        """Add a subscriber.
+
+        Args:
+          handler: The handler called with each data from the subscriber's
+            dispatch thread.  bytes data is shared with other subscribers.
+          data_filter: The callable taking each data and returning whether
+            the subscriber gets it, called from the read thread so it must
+            be fast.  Default every data.
+          maxsize: The most data queued for the subscriber.
+          policy: The ReceiveQueue policy when the queue is full.  The
+            default drops the oldest data; POLICY_BLOCK stalls the reader
+            and every other subscriber with it.
+          name: The name of the subscriber in metrics, default the handler.
+            A name already in use gets a #number suffix.
+        Returns:
+          The Subscription, for unsubscribe.
+        Raises:
+          ValueError: The policy is unknown.
+        """
+        name = name or getattr(handler, '__name__', repr(handler))
+        subscription = Subscription(name, data_filter,
+                                    ReceiveQueue(handler, maxsize, policy))
+        with self._lock:
+            names = {item.name for item in self._subscriptions}
+            while subscription.name in names:
+                subscription.name = '{}#{}'.format(name, next(self._numbers))
+            if self._running:
+                subscription.queue.start()
+            self._subscriptions += (subscription,)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscriber and stop its dispatch thread.
+
+        Args:
+          subscription: The Subscription returned by subscribe.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        with self._lock:
+            self._subscriptions = tuple(
+                item for item in self._subscriptions
+                if item is not subscription)
+        subscription.queue.stop()
+
+    def publish(self, data):
+        """Queue data to every subscriber whose filter accepts it, called
+        from the read thread.
+
+        Args:
+          data: The str, bytes, memoryview or TaggedFrame read.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        elif isinstance(data, TaggedFrame) and \
+                isinstance(data.payload, memoryview):
+            data = TaggedFrame(bytes(data.payload), data.valid)
+
+        for subscription in self._subscriptions:
+            if subscription.data_filter is not None:
+                try:
+                    if not subscription.data_filter(data):
+                        continue
+                except Exception:
+                    logging.exception('Filter of {} failed'.format(
+                        subscription.name))
+                    continue
+            subscription.queue.put(data)
+
+    def start(self):
+        """Start dispatch threads."""
+        with self._lock:
+            self._running = True
+            for subscription in self._subscriptions:
+                subscription.queue.start()
+
+    def stop(self, timeout=None):
+        """Stop dispatch threads, the queued data is kept.
+
+        Args:
+          timeout: The most seconds to wait for each handler in progress.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        with self._lock:
+            self._running = False
+            subscriptions = self._subscriptions
+        for subscription in subscriptions:
+            subscription.queue.stop(timeout)
+
+    def metrics(self):
+        """Return dict of the total queue depth and the metrics of each
+        subscriber by name."""
+        subscribers = {subscription.name: subscription.metrics()
+                       for subscription in self._subscriptions}
+        return {'depth': sum(metrics['depth']
+                             for metrics in subscribers.values()),
+                'subscribers': subscribers}
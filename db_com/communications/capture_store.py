@@ -0,0 +1,266 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a capture store module.
+
+This module has a class used to keep the lines received by Serial in a
+SQLite database for long soak tests. The read thread only queues lines; a
+store thread inserts them in batches, one transaction each. Lines are
+indexed on time and on port and time, and their payload in an FTS5 table
+when SQLite has it, so searches stay fast over weeks of data.
+
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from db_com.communications.recorder import DIRECTION_RX
+
+CapturedLine = namedtuple('CapturedLine', 'port time direction payload')
+
+SELECTIVE_MATCHES = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    port TEXT NOT NULL,
+    time REAL NOT NULL,
+    direction INTEGER NOT NULL,
+    payload TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS lines_time ON lines (time);
+CREATE INDEX IF NOT EXISTS lines_port_time ON lines (port, time);
+"""
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5 (
+    payload, content='lines', content_rowid='id');
+"""
+
+
+class CaptureStore(object):
+    """Class stores received lines in a SQLite database."""
+
+    def __init__(self, path, batch_size=1000, flush_interval=0.5,
+                 maxsize=100000):
+        """Configure the store and create the schema.
+
+        Args:
+          path: The database file.
+          batch_size: The most lines inserted per transaction.
+          flush_interval: The most seconds a line waits to be inserted.
+          maxsize: The most lines waiting for the store thread.  Later lines
+            are dropped and counted rather than blocking the reader.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize)
+        self._store_thread = None
+        self._store_alive = False
+        self._stored = 0
+        self._dropped = 0
+        # Times are wall clock, advanced by the monotonic clock so they
+        # never jump within a session.
+        self._wall_base = time.time()
+        self._monotonic_base = time.monotonic()
+
+        connection = sqlite3.connect(path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            self._fts = True
+        except sqlite3.OperationalError:
+            logging.warning('SQLite has no FTS5, payload search will scan.')
+            self._fts = False
+        connection.close()
+        self._connection = None
+
+    @property
+    def path(self):
+        """A property indicating the database file."""
+        return self._path
+
+    def metrics(self):
+        """Return dict of lines stored, waiting and dropped."""
+        return {'stored': self._stored, 'queue_depth': self._queue.qsize(),
+                'dropped': self._dropped}
+
+    def now(self):
+        """Return the current time in the clock of the store."""
+        return self._wall_base + time.monotonic() - self._monotonic_base
+
+    def record(self, port, payload, direction=DIRECTION_RX):
+        """Queue a line, called from the Serial threads.
+
+        Args:
+          port: The port name.
+          payload: The str line, or bytes decoded like Serial does.
+          direction: DIRECTION_RX or DIRECTION_TX.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if not isinstance(payload, str):
+            payload = str(payload, 'utf-8', 'ignore')
+        try:
+            self._queue.put_nowait((port, self.now(), direction, payload))
+        except queue.Full:
+            self._dropped += 1
+
+    def handler(self, port, read_handler=None):
+        """Return a read handler for a Serial storing each line.
+
+        Args:
+          port: The port name stored with the lines.
+          read_handler: The handler the lines are then passed to, if any.
+        Returns:
+          The read handler.
+        """
+        def store_handler(data):
+            self.record(port, data)
+            if read_handler is not None:
+                read_handler(data)
+
+        return store_handler
+
+    def start(self):
+        """Start store thread."""
+        if self._store_alive:
+            return
+        self._store_alive = True
+        self._store_thread = threading.Thread(target=self.store,
+                                              name='CaptureStore')
+        self._store_thread.daemon = True
+        self._store_thread.start()
+
+    def stop(self):
+        """Insert the queued lines and stop store thread."""
+        if not self._store_alive:
+            return
+        self._store_alive = False
+        self._store_thread.join()
+
+    def store(self):
+        """Thread function, inserting queued lines in batches."""
+        connection = sqlite3.connect(self._path)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        try:
+            while self._store_alive or not self._queue.empty():
+                batch = []
+                deadline = time.monotonic() + self._flush_interval
+                while len(batch) < self._batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+                if batch:
+                    self._insert(connection, batch)
+        finally:
+            connection.close()
+
+    def _insert(self, connection, batch):
+        """Insert a batch of lines in one transaction."""
+        with connection:
+            last = connection.execute('SELECT COALESCE(MAX(id), 0) '
+                                      'FROM lines').fetchone()[0]
+            connection.executemany('INSERT INTO lines (port, time, direction, '
+                                   'payload) VALUES (?, ?, ?, ?)', batch)
+            # One statement for the batch is several times faster than a
+            # trigger per row.
+            if self._fts:
+                connection.execute('INSERT INTO lines_fts (rowid, payload) '
+                                   'SELECT id, payload FROM lines '
+                                   'WHERE id > ?', (last,))
+        self._stored += len(batch)
+
+    def search(self, text=None, port=None, start=None, end=None,
+               direction=None, limit=1000):
+        """Find stored lines, oldest first.
+
+        Args:
+          text: The FTS5 query the payload matches, e.g. 'ERROR', or a
+            substring when SQLite has no FTS5.
+          port: The port name.
+          start: The earliest time, see now.
+          end: The latest time.
+          direction: DIRECTION_RX or DIRECTION_TX.
+          limit: The most lines returned, None for all.
+        Returns:
+          List of CapturedLine.
+        Raises:
+          sqlite3.OperationalError: The FTS5 query is invalid.
+        """
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._path,
+                                               check_same_thread=False)
+
+        query = 'SELECT port, time, direction, payload FROM lines'
+        conditions, parameters = [], []
+        # Unary + keeps SQLite off the port and time indexes, so a rare text
+        # is looked up in the FTS index first instead of being checked
+        # against every line of the time range.
+        unindexed = ''
+        if text is not None:
+            if self._fts:
+                conditions.append('id IN (SELECT rowid FROM lines_fts '
+                                  'WHERE lines_fts MATCH ?)')
+                if self._selective(text):
+                    unindexed = '+'
+            else:
+                conditions.append('instr(payload, ?) > 0')
+            parameters.append(text)
+        for column, operator, value in (('port', '=', port),
+                                        ('time', '>=', start),
+                                        ('time', '<=', end),
+                                        ('direction', '=', direction)):
+            if value is not None:
+                conditions.append('{}{} {} ?'.format(unindexed, column,
+                                                     operator))
+                parameters.append(value)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY time'
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+
+        return [CapturedLine(*row)
+                for row in self._connection.execute(query, parameters)]
+
+    def _selective(self, text):
+        """Whether an FTS5 query matches at most SELECTIVE_MATCHES lines."""
+        cursor = self._connection.execute(
+            'SELECT COUNT(*) FROM (SELECT rowid FROM lines_fts '
+            'WHERE lines_fts MATCH ? LIMIT ?)', (text, SELECTIVE_MATCHES + 1))
+        return cursor.fetchone()[0] <= SELECTIVE_MATCHES
+
+    def close(self):
+        """Stop store thread and close the search connection."""
+        self.stop()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a checksum module.
+
+This module has a class used to validate the checksum trailer of received
+frames before they reach the read handler. CRCs are computed by binascii and
+zlib, and XOR sums by NumPy over a whole batch of frames when it is
+installed, so no Python loop runs per byte.
+
+"""
+
+import binascii
+import zlib
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TaggedFrame = namedtuple('TaggedFrame', 'payload valid')
+
+POLICY_DROP, POLICY_TAG = 'drop', 'tag'
+
+
+def crc16_ccitt(data):
+    """CRC-16/CCITT-FALSE, polynomial 0x1021 initial 0xFFFF."""
+    return binascii.crc_hqx(data, 0xffff)
+
+
+def crc16_xmodem(data):
+    """CRC-16/XMODEM, polynomial 0x1021 initial 0."""
+    return binascii.crc_hqx(data, 0)
+
+
+def crc32(data):
+    """CRC-32 as used by zlib and Ethernet."""
+    return zlib.crc32(data) & 0xffffffff
+
+
+def xor8(data):
+    """XOR of every byte.
+
+    Without NumPy the bytes are folded as one big integer, halving its width
+    each step.
+    """
+    if numpy is not None:
+        return int(numpy.bitwise_xor.reduce(
+            numpy.frombuffer(data, dtype=numpy.uint8), initial=0))
+
+    value = int.from_bytes(data, 'little')
+    width = max(len(data), 1) * 8
+    while width > 8:
+        width = (width + 15) // 16 * 8
+        value = (value >> width) ^ (value & ((1 << width) - 1))
+    return value
+
+
+def xor8_batch(frames):
+    """XOR of every byte of each frame, in one NumPy call for the batch."""
+    if numpy is None or not frames:
+        return [xor8(frame) for frame in frames]
+
+    lengths = numpy.fromiter((len(frame) for frame in frames),
+                             dtype=numpy.intp, count=len(frames))
+    data = numpy.frombuffer(b''.join(frames) + b'\x00', dtype=numpy.uint8)
+    offsets = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+    sums = numpy.bitwise_xor.reduceat(data, offsets)
+    # reduceat returns the element at the offset for empty frames.
+    sums[lengths == 0] = 0
+    return sums.tolist()
+
+
+ALGORITHMS = {
+    'crc16': (2, crc16_ccitt),
+    'crc16_xmodem': (2, crc16_xmodem),
+    'crc32': (4, crc32),
+    'xor8': (1, xor8),
+}
+
+
+class ChecksumStage(object):
+    """Class checks the checksum trailer of frames.
+
+    An instance is given to Serial as frame_filter: it receives each batch
+    of frames read and returns the frames to hand to the read handler,
+    without their trailer.
+    """
+
+    def __init__(self, algorithm='crc16', byteorder='big', policy=POLICY_DROP):
+        """Configure the stage.
+
+        Args:
+          algorithm: The name of an algorithm in ALGORITHMS, or a
+            (trailer size, function) pair.
+          byteorder: The byte order of the trailer, 'big' or 'little'.
+          policy: POLICY_DROP to drop bad frames, or POLICY_TAG to hand every
+            frame on as TaggedFrame(payload, valid).
+        Returns:
+          None
+        Raises:
+          ValueError: The algorithm or policy is unknown.
+        """
+        if not isinstance(algorithm, tuple):
+            if algorithm not in ALGORITHMS:
+                raise ValueError('Unknown checksum {}.'.format(algorithm))
+            self._batch = xor8_batch if algorithm == 'xor8' else None
+            algorithm = ALGORITHMS[algorithm]
+        else:
+            self._batch = None
+        if policy not in (POLICY_DROP, POLICY_TAG):
+            raise ValueError('Unknown policy {}.'.format(policy))
+
+        self._size, self._function = algorithm
+        self._byteorder = byteorder
+        self._policy = policy
+        self.frames = 0
+        self.bad_frames = 0
+
+    def __call__(self, frames):
+        """Check a batch of frames.
+
+        Args:
+          frames: List of bytes or memoryview frames, trailer included.
+        Returns:
+          List of the payloads of the good frames, or of TaggedFrame for
+            every frame with POLICY_TAG.
+        Raises:
+          None
+        """
+        size = self._size
+        payloads = [frame[:-size] if len(frame) >= size else frame[:0]
+                    for frame in frames]
+        if self._batch is not None:
+            sums = self._batch(payloads)
+        else:
+            sums = [self._function(payload) for payload in payloads]
+
+        result = []
+        for frame, payload, value in zip(frames, payloads, sums):
+            valid = len(frame) >= size and value == int.from_bytes(
+                frame[len(frame) - size:], self._byteorder)
+            if not valid:
+                self.bad_frames += 1
+            if self._policy == POLICY_TAG:
+                result.append(TaggedFrame(payload, valid))
+            elif valid:
+                result.append(payload)
+        self.frames += len(frames)
+
+        return result
+
+    def append(self, payload):
+        """Return the payload followed by its checksum trailer, for sending."""
+        payload = bytes(payload)
+        return payload + self._function(payload).to_bytes(self._size,
+                                                          self._byteorder)
@@ -19,7 +19,10 @@ This module has a class used to communicate via serial.
 
 """
 
+import io
 import logging
+import os
+import select
 import serial
 import time
 import threading
@@ -27,6 +30,18 @@ import threading
 from serial.tools import list_ports
 
 from db_com.communications.communication_interface import CommunicationInterface
+from db_com.communications.broadcast_hub import BroadcastHub
+from db_com.communications.checksum import TaggedFrame
+from db_com.communications.framers import LineFramer
+from db_com.communications.matcher import MultiStreamMatcher, StreamMatcher
+from db_com.communications.paced_writer import PacedWriter
+from db_com.communications.port_stats import PortStats
+from db_com.communications.receive_buffer import ReceiveBuffer
+from db_com.communications.receive_queue import ReceiveQueue
+from db_com.communications.recorder import DIRECTION_TX
+
+# Read handlers with dispatch threads, started and stopped with the port.
+_QUEUED_HANDLERS = (ReceiveQueue, BroadcastHub)
 
 
 class Serial(CommunicationInterface):
@@ -36,12 +51,15 @@ class Serial(CommunicationInterface):
         'N', 'E', 'O', 'M', 'S'
     STOPBITS_ONE, STOPBITS_ONE_POINT_FIVE, STOPBITS_TWO = (1, 1.5, 2)
     FIVEBITS, SIXBITS, SEVENBITS, EIGHTBITS = (5, 6, 7, 8)
+    ABORT_INTERVAL = 0.01
 
     def __init__(self, port, baudrate, databit=EIGHTBITS,
                  parity=PARITY_NONE, stopbits=STOPBITS_ONE, xonxoff=False,
                  rtscts=False, dsrdtr=False, read_terminal_character='\r\n',
                  write_terminal_character='\n', timeout=20, write_timeout=20,
-                 read_handler=None):
+                 read_handler=None, bytes_mode=False, buffer_size=65536,
+                 framer=None, frame_filter=None, write_rate=None,
+                 write_chunk_size=1):
         """Configure the driver initial values.
 
         Args:
@@ -60,11 +78,28 @@ class Serial(CommunicationInterface):
             reading from the device.
           write_terminal_character: The terminal character expected when
             writing to the device.
-          read_handler: The handler handles read data from read thread.
+          read_handler: The handler handles read data from read thread.  A
+            slow handler is wrapped in a ReceiveQueue, and many handlers
+            subscribe to a BroadcastHub, which are started and stopped with
+            the port.
+          bytes_mode: The boolean bytes mode to use.  In bytes mode reads
+            return bytes, and the read thread hands each frame to the handler
+            as a memoryview, which is only valid until the handler returns.
+          buffer_size: The size of the receive buffer.
+          framer: The framer cutting received data into frames, see the
+            framers module.  Default lines ending with
+            read_terminal_character.  Binary framers need bytes mode.
+          frame_filter: The callable taking each list of frames read and
+            returning the list to hand on, e.g. checksum.ChecksumStage.
+            Needs bytes mode.
+          write_rate: The bytes per second writes are paced to by a writer
+            thread, None to write at once.
+          write_chunk_size: The bytes written at once when paced.
         Returns:
           None
         Raises:
-          None
+          ValueError: A binary framer or a frame filter is used without bytes
+            mode.
         """
         super(Serial, self).__init__()
         self._port = port
@@ -82,7 +117,24 @@ class Serial(CommunicationInterface):
         self._session = None
         self._reader_alive = None
         self._reader_thread = None
+        self._reader_wakeup = None
         self._read_handler = read_handler
+        self._bytes_mode = bytes_mode
+        if framer is None:
+            framer = LineFramer(bytes(read_terminal_character, 'utf-8'))
+        elif not bytes_mode and not isinstance(framer, LineFramer):
+            raise ValueError('Binary framers need bytes mode.')
+        if frame_filter is not None and not bytes_mode:
+            raise ValueError('Frame filters need bytes mode.')
+        self._frame_filter = frame_filter
+        self._framed = not isinstance(framer, LineFramer)
+        self._rx_buffer = ReceiveBuffer(buffer_size, framer)
+        self._recorder = None
+        self._trace = None
+        self._stats = PortStats()
+        self._write_rate = write_rate
+        self._write_chunk_size = write_chunk_size
+        self._paced_writer = None
 
     @property
     def session(self):
@@ -169,6 +221,11 @@ class Serial(CommunicationInterface):
         """Sets the dsrdtr."""
         self._dsrdtr = value
 
+    @property
+    def read_terminal_character(self):
+        """A property indicating the terminal character of read lines."""
+        return self._read_terminal_character
+
     @property
     def read_handler(self):
         """The read handler for read thread."""
@@ -179,6 +236,78 @@ class Serial(CommunicationInterface):
         """Set read handler for read thread."""
         self._read_handler = value
 
+    @property
+    def recorder(self):
+        """The recorder of the traffic, see the recorder module."""
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, value):
+        """Set recorder of the traffic, None to stop recording."""
+        self._recorder = value
+
+    @property
+    def trace(self):
+        """The wire trace of the traffic, see the wire_trace module."""
+        return self._trace
+
+    @trace.setter
+    def trace(self, value):
+        """Set wire trace of the traffic, None to disable tracing."""
+        self._trace = value
+
+    @property
+    def stats(self):
+        """A property containing the PortStats of the port."""
+        return self._stats
+
+    @property
+    def paced_writer(self):
+        """A property containing the PacedWriter of the port, None until
+        a paced write."""
+        return self._paced_writer
+
+    def statistics(self):
+        """Return dict of the I/O counters, framing errors and receive
+        queue depth, read without locking."""
+        statistics = self._stats.snapshot()
+        statistics['framing_errors'] = self._rx_buffer.framer.errors + \
+            getattr(self._frame_filter, 'bad_frames', 0)
+        statistics['queue_depth'] = 0
+        if isinstance(self._read_handler, _QUEUED_HANDLERS):
+            statistics['queue_depth'] = \
+                self._read_handler.metrics()['depth']
+
+        return statistics
+
+    @property
+    def bytes_mode(self):
+        """A property indicating whether reads return bytes."""
+        return self._bytes_mode
+
+    @property
+    def framer(self):
+        """A property indicating the framer."""
+        return self._rx_buffer.framer
+
+    @property
+    def frame_filter(self):
+        """A property indicating the frame filter."""
+        return self._frame_filter
+
+    @staticmethod
+    def decode(data):
+        """Decode data returned in bytes mode to text.
+
+        Args:
+          data: The bytes or memoryview to decode.
+        Returns:
+          The decoded str.
+        Raises:
+          None.
+        """
+        return ReceiveBuffer.decode(data)
+
     @staticmethod
     def list_ports():
         """List available serial port connections.
@@ -194,33 +323,45 @@ class Serial(CommunicationInterface):
 
         return ports
 
-    def open(self):
+    def open(self, start_reader=True):
         """Open serial port connection.
 
         Args:
-          None.
+          start_reader: Whether to start the read thread when a read handler
+            is set.  PortManager opens ports without one and reads them
+            from its own loop.
         Returns:
           None.
         Raises:
           None.
         """
-        self._session = serial.Serial()
-        self._session.port = self.port
-        self._session.baudrate = self.baudrate
-        self._session.bytesize = self.databit
-        self._session.parity = self.parity
-        self._session.stopbits = self.stopbits
-        self._session.xonxoff = self.xonxoff
-        self._session.rtscts = self.rtscts
-        self._session.dsrdtr = self.dsrdtr
+        self._session = self._create_session()
         self._session.timeout = 1
         self._session.open()
+        self._rx_buffer.clear()
         logging.debug('Opened serial connection to {}'.format(self.port))
 
-        if self._read_handler:
+        if isinstance(self._read_handler, _QUEUED_HANDLERS):
+            self._read_handler.start()
+        if self._read_handler and start_reader:
             self._start_reader()
             logging.debug('Open serial reader thread.')
 
+    def _create_session(self):
+        """Create a serial session configured from the properties, not
+        opened yet."""
+        session = serial.Serial()
+        session.port = self.port
+        session.baudrate = self.baudrate
+        session.bytesize = self.databit
+        session.parity = self.parity
+        session.stopbits = self.stopbits
+        session.xonxoff = self.xonxoff
+        session.rtscts = self.rtscts
+        session.dsrdtr = self.dsrdtr
+
+        return session
+
     def close(self):
         """Close serial port connection.
 
@@ -234,6 +375,10 @@ class Serial(CommunicationInterface):
         if self._session:
             if self._reader_alive:
                 self._stop_reader()
+            if self._paced_writer is not None:
+                self._paced_writer.stop()
+            if isinstance(self._read_handler, _QUEUED_HANDLERS):
+                self._read_handler.stop()
             if self._session.isOpen():
                 self._session.close()
             self._session = None
@@ -243,23 +388,28 @@ class Serial(CommunicationInterface):
         """Reads data from the device.
 
         Args:
-          timeout: The session timeout.
+          timeout: The most seconds to wait for a line, default the timeout
+            of the port.
         Returns:
-          read_buffer: The buffer read from device.
+          read_buffer: The line read from device, or the partial line on
+            timeout.  In bytes mode the frame.  Empty lines are skipped.
         Raises:
           None.
         """
-        self._session.timeout = self._timeout
-        if timeout is not None:
-            self._session.timeout = timeout
-
-        read_buffer = str(self._session.readline(),
-                          'utf-8', 'ignore').strip('\x00')
-        if read_buffer:
-            logging.debug('read : {}'.format(read_buffer.strip(
-                self._read_terminal_character)))
-
-        return read_buffer.strip(self._read_terminal_character)
+        if timeout is None:
+            timeout = self._timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            read_buffer = self._read_frame(deadline)
+            if not self._bytes_mode:
+                read_buffer = self.decode(read_buffer).strip(
+                    self._read_terminal_character)
+            if read_buffer:
+                self._stats.lines_in += 1
+                return read_buffer
+            if time.monotonic() >= deadline:
+                return read_buffer
 
     def write(self, command, timeout=None, wait_between_characters=None):
         """Writes data to the device.
@@ -268,25 +418,43 @@ class Serial(CommunicationInterface):
           command: The string command to be written.
           timeout: The timeout for the connection.
           wait_between_characters: The time to wait between each character in
-            the command to send.
+            the command to send, terminal character included.  The
+            characters are paced by the writer thread, this waits for the
+            last one.
         Returns:
           None.
         Raises:
-          None.
+          concurrent.futures.CancelledError: The port was closed during a
+            paced write.
         """
-        logging.debug('write : {}'.format(command))
         self._session.writeTimeout = self._write_timeout
         if timeout is not None:
             self._session.writeTimeout = timeout
 
-        if wait_between_characters is None:
-            self._session.write(bytes(command + self._write_terminal_character,
-                                      'utf-8'))
+        data = bytes(command + self._write_terminal_character, 'utf-8')
+        if wait_between_characters is not None:
+            self._paced_write(data, 1 / wait_between_characters
+                              if wait_between_characters > 0 else None, 1)
+        elif self._write_rate is not None:
+            self._paced_write(data, self._write_rate, self._write_chunk_size)
         else:
-            for char in command:
-                self._session.write(char)
-                time.sleep(wait_between_characters)
-            self._session.write(self._write_terminal_character)
+            self._session.write(data)
+        self._stats.writes += 1
+        self._stats.bytes_out += len(data)
+        self._stats.lines_out += 1
+        if self._recorder is not None:
+            self._recorder.record(data, DIRECTION_TX)
+        if self._trace is not None:
+            self._trace.record(data, DIRECTION_TX)
+
+    def _paced_write(self, data, rate, chunk_size):
+        """Write data from the paced writer thread and wait for it."""
+        if self._paced_writer is None:
+            self._paced_writer = PacedWriter(
+                self, self._write_rate, self._write_chunk_size,
+                jitter=self._stats.pacing_jitter)
+        self._paced_writer.start()
+        self._paced_writer.send(data, rate, chunk_size).result()
 
     def query(self, command, timeout=None, write_timeout=None,
               wait_between_commands=None, wait_between_characters=None):
@@ -306,12 +474,16 @@ class Serial(CommunicationInterface):
         Raises:
           None.
         """
-        logging.debug('query : {}'.format(command))
+        logging.debug('query : %s', command)
+        start = time.perf_counter()
         self.write(command, write_timeout,
                    wait_between_characters=wait_between_characters)
         if wait_between_commands is not None:
             time.sleep(wait_between_commands)
-        return self.read(timeout=timeout)
+        response = self.read(timeout=timeout)
+        self._stats.query_latency.record(time.perf_counter() - start)
+
+        return response
 
     def read_untils(self, read_until_list, timeout=None, force_abort=None):
         """Reads info from device until the read_until_list is
@@ -323,7 +495,8 @@ class Serial(CommunicationInterface):
           force_abort: The abort callback to force stop.
         Returns:
           response: Response from the device whether or not the
-            read_until_list is obtained
+            read_until_list is obtained.  With a binary framer, the list of
+            frames read, the last one holding the pattern if obtained.
         Raises:
           None.
         """
@@ -331,35 +504,10 @@ class Serial(CommunicationInterface):
         if timeout is not None:
             read_timeout = timeout
 
-        start_time = time.time()
-        response = ''
-        read_buffer = ''
+        read_until_list = [self._encode(key) for key in read_until_list]
 
-        continue_flag = True
-
-        while continue_flag and (time.time() - start_time) <= read_timeout:
-            if force_abort is not None and force_abort():
-                return ''
-
-            for key_string in read_until_list:
-                if response.find(key_string) != -1 or \
-                        read_buffer.find(key_string) != -1:
-                    continue_flag = False
-
-            read_data = str(self._session.readline(),
-                            'utf-8', 'ignore').strip('\x00')
-            if read_data:
-                logging.debug(read_data.strip('\r\n'))
-            read_buffer += read_data
-
-            if read_buffer.find(self._read_terminal_character) != -1:
-                response += read_buffer
-                read_buffer = ''
-
-        if read_buffer:
-            response += read_buffer
-
-        return response
+        return self._read_matched(MultiStreamMatcher(read_until_list),
+                                  read_timeout, force_abort)
 
     def read_until(self, read_until_string, timeout=None, force_abort=None):
         """Reads info from device until the read_until_string is
@@ -371,7 +519,8 @@ class Serial(CommunicationInterface):
           force_abort: The abort callback to force stop.
         Returns:
           response: Response from the device whether or not the
-            read_until_string is obtained
+            read_until_string is obtained.  With a binary framer, the list
+            of frames read, the last one holding the pattern if obtained.
         Raises:
           None.
         """
@@ -379,29 +528,84 @@ class Serial(CommunicationInterface):
         if timeout is not None:
             read_until_timeout = timeout
 
-        start_time = time.time()
-        response = ''
-        read_buffer = ''
-        while response.find(read_until_string) == -1 \
-                and read_buffer.find(read_until_string) == -1 \
-                and (time.time() - start_time) <= read_until_timeout:
-            if force_abort is not None and force_abort():
-                return ''
+        return self._read_matched(
+            StreamMatcher(self._encode(read_until_string)),
+            read_until_timeout, force_abort)
 
-            read_data = str(self._session.readline(),
-                            'utf-8', 'ignore').strip('\x00')
-            if read_data:
-                logging.debug(read_data.strip('\r\n'))
-            read_buffer += read_data
+    def _read_matched(self, matcher, timeout, force_abort=None):
+        """Reads info from device until the matcher has seen its pattern or
+        timeout has expired.
 
-            if read_buffer.find(self._read_terminal_character) != -1:
-                response += read_buffer
-                read_buffer = ''
+        The deadline is taken from the monotonic clock and data is waited
+        for with select, so the call returns as soon as the pattern arrives
+        or the deadline passes, and force_abort is polled every
+        ABORT_INTERVAL seconds.  Data is matched as raw bytes as it arrives
+        and text mode decodes the response once.  Data after the pattern is
+        left for the next read, in text mode from the end of its line.
+        With a binary framer the pattern is looked for inside each frame.
 
-        if read_buffer:
-            response += read_buffer
+        Args:
+          matcher: The StreamMatcher or MultiStreamMatcher of bytes to feed.
+          timeout: The timeout for the connection.
+          force_abort: The abort callback to force stop.
+        Returns:
+          response: Response from the device whether or not the pattern is
+            obtained.
+        Raises:
+          None.
+        """
+        deadline = time.monotonic() + timeout
+        chunks = []
+        consumed = 0
+        while not matcher.matched:
+            if force_abort is not None and force_abort():
+                if self._framed:
+                    return []
+                return b'' if self._bytes_mode else ''
+
+            if self._framed:
+                frame = self._next_frame()
+                if frame is not None:
+                    chunks.append(frame)
+                    matcher.reset()
+                    matcher.feed(frame.payload if isinstance(
+                        frame, TaggedFrame) else frame)
+                    continue
+            elif self._rx_buffer:
+                size = None
+                if matcher.feed(self._rx_buffer.peek()):
+                    size = self._match_end(matcher, consumed)
+                chunk = bytes(self._rx_buffer.take(size))
+                chunks.append(chunk)
+                consumed += len(chunk)
+                continue
+
+            if not self._fill_before(deadline, force_abort is not None) and \
+                    time.monotonic() >= deadline:
+                break
+
+        if self._framed:
+            return chunks
+        response = b''.join(chunks)
+        return response if self._bytes_mode else self.decode(response)
+
+    def _match_end(self, matcher, consumed):
+        """Return the size of the receive buffer data up to the end of the
+        pattern matched, in text mode up to the end of its line if it is
+        already received.
 
-        return response
+        Args:
+          matcher: The matched StreamMatcher or MultiStreamMatcher.
+          consumed: The stream offset of the receive buffer data.
+        """
+        pattern = matcher.match if isinstance(matcher, MultiStreamMatcher) \
+            else matcher.pattern
+        end = matcher.position + len(pattern) - consumed
+        if self._bytes_mode:
+            return end
+        index = self._rx_buffer.find(self._rx_buffer.framer.separator,
+                                     max(0, end - 1))
+        return end if index == -1 else index + 1
 
     def query_until(self, command, read_until_string, timeout=None,
                     wait_between_commands=None, wait_between_characters=None,
@@ -425,29 +629,194 @@ class Serial(CommunicationInterface):
         Raises:
           None.
         """
-        logging.debug('query : {}, until {}'.format(command, read_until_string))
+        logging.debug('query : %s, until %s', command, read_until_string)
+        start = time.perf_counter()
         self.write(command, write_timeout,
                    wait_between_characters=wait_between_characters)
         if wait_between_commands is not None:
             time.sleep(wait_between_commands)
-        return self.read_until(read_until_string, timeout=timeout)
+        response = self.read_until(read_until_string, timeout=timeout)
+        self._stats.query_latency.record(time.perf_counter() - start)
+
+        return response
 
     def reader(self):
-        """Thread function, reading serial data and send to handler."""
-        data = None
+        """Thread function, reading serial data and send to handler.
+
+        The thread sleeps until the port is readable, drains everything
+        waiting in one read and splits the lines in memory.
+        """
         try:
             while self._reader_alive:
-                data = self.read()
-                if data:
-                    self._read_handler(data)
-        except self._session.SerialException:
+                if self._wait_readable():
+                    self.dispatch()
+        except serial.SerialException as error:
             self._reader_alive = False
-            logging.error(data)
+            logging.error(error)
             raise
 
+    def dispatch(self):
+        """Drain the waiting data and send every complete line to the read
+        handler.
+
+        Called by the read thread, or by PortManager when the port is
+        readable.
+
+        Args:
+          None.
+        Returns:
+          count: Number of bytes read.
+        Raises:
+          serial.SerialException: The port failed.
+        """
+        count = self._fill()
+        self._deliver()
+
+        return count
+
+    def feed(self, data):
+        """Hand data received elsewhere, e.g. replayed from a capture, to
+        the read handler as if it was read from the port.
+
+        Args:
+          data: The bytes to frame and deliver.
+        Returns:
+          None.
+        Raises:
+          None.
+        """
+        source = io.BytesIO(data)
+        while self._rx_buffer.fill(source):
+            self._deliver()
+
+    def _deliver(self):
+        """Send every complete frame in the receive buffer to the read
+        handler."""
+        start = time.perf_counter()
+        lines = 0
+        frames = self._rx_buffer.frames()
+        if self._frame_filter is not None:
+            frames = self._frame_filter(list(frames))
+        for data in frames:
+            if not self._bytes_mode:
+                data = self.decode(data).strip(self._read_terminal_character)
+                if not data:
+                    continue
+            self._read_handler(data)
+            lines += 1
+        self._stats.lines_in += lines
+        self._stats.handler_time += time.perf_counter() - start
+
+    def _wait_readable(self, timeout=None):
+        """Wait until the port has data or the reader is stopped.
+
+        Ports without a file descriptor are reported readable at once, and
+        the read itself waits for the session timeout instead.
+
+        Args:
+          timeout: The most seconds to wait, default forever.
+        Returns:
+          True if the port is readable.
+        Raises:
+          None.
+        """
+        try:
+            fileno = self._session.fileno()
+        except (AttributeError, OSError):
+            return True
+
+        waits = [fileno]
+        if self._reader_wakeup:
+            waits.append(self._reader_wakeup[0])
+        readable, _, _ = select.select(waits, [], [], timeout)
+
+        return fileno in readable
+
+    def _fill(self):
+        """Reads what is waiting, or at least one byte, into the receive
+        buffer."""
+        count = self._rx_buffer.fill(self._session,
+                                     max(1, self._session.in_waiting))
+        self._stats.reads += 1
+        self._stats.bytes_in += count
+        if count and self._recorder is not None:
+            self._recorder.record(self._rx_buffer.last(count))
+        if count and self._trace is not None:
+            self._trace.record(self._rx_buffer.last(count))
+
+        return count
+
+    def _fill_before(self, deadline, abortable=False):
+        """Wait for data until the deadline and read it into the receive
+        buffer.
+
+        Ports without a file descriptor cannot be waited for, and the read
+        itself waits up to the session timeout instead.
+
+        Args:
+          deadline: The time.monotonic() time to give up at.
+          abortable: Whether to return every ABORT_INTERVAL seconds, so the
+            caller can poll its abort callback.
+        Returns:
+          count: Number of bytes read, 0 on timeout.
+        Raises:
+          serial.SerialException: The port failed.
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return 0
+        if abortable:
+            remaining = min(remaining, self.ABORT_INTERVAL)
+        if not self._wait_readable(remaining):
+            return 0
+
+        return self._fill()
+
+    def _next_frame(self):
+        """Return the next complete frame in the receive buffer as bytes, or
+        TaggedFrame from the frame filter, or None."""
+        for frame in self._rx_buffer.frames():
+            if self._frame_filter is None:
+                return bytes(frame)
+            for frame in self._frame_filter([frame]):
+                if isinstance(frame, TaggedFrame):
+                    return TaggedFrame(bytes(frame.payload), frame.valid)
+                return bytes(frame)
+
+        return None
+
+    def _read_frame(self, deadline):
+        """Reads one frame before the deadline.
+
+        Args:
+          deadline: The time.monotonic() time to give up at.
+        Returns:
+          The frame as bytes, or TaggedFrame from the frame filter.  On
+            timeout the partial line, or b'' with a binary framer.
+        """
+        while True:
+            frame = self._next_frame()
+            if frame is not None:
+                return frame
+            if not self._fill_before(deadline) and \
+                    time.monotonic() >= deadline:
+                break
+
+        if self._framed:
+            return b''
+        return bytes(self._rx_buffer.take())
+
+    @staticmethod
+    def _encode(data):
+        """Encode a str pattern for bytes mode."""
+        if isinstance(data, str):
+            return bytes(data, 'utf-8')
+        return data
+
     def _start_reader(self):
         """Start reader thread"""
         self._reader_alive = True
+        self._reader_wakeup = os.pipe()
         self._reader_thread = threading.Thread(target=self.reader,
                                                name='Serial_Rx')
         self._reader_thread.daemon = True
@@ -456,6 +825,13 @@ class Serial(CommunicationInterface):
     def _stop_reader(self):
         """Stop reader thread only, wait for clean exit of thread"""
         self._reader_alive = False
+        os.write(self._reader_wakeup[1], b'x')
         if hasattr(self._session, 'cancel_read'):
             self._session.cancel_read()
+        if isinstance(self._read_handler, _QUEUED_HANDLERS):
+            # Release the reader if it is blocked on a full queue.
+            self._read_handler.stop()
         self._reader_thread.join()
+        for fileno in self._reader_wakeup:
+            os.close(fileno)
+        self._reader_wakeup = None
@@ -0,0 +1,274 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a framing module.
+
+This module has classes used to cut the bytes collected by ReceiveBuffer
+into frames: text lines, length-prefixed records, SLIP, COBS, fixed-size
+records and raw chunks. Frames are found with bytes.find and slicing rather
+than a Python loop per byte, and are returned as memoryview slices of the
+buffer unless they have to be decoded.
+
+Every framer has the same two methods. next_frame(buffer, view, start, end)
+looks at buffer[start:end] and returns None if no complete frame is there
+yet, or (frame, next_start) where frame may be None for data that is
+skipped. overflow(data) is called with the whole buffer when it is full
+without a complete frame, and returns a frame or None to drop the data.
+
+"""
+
+SLIP_END, SLIP_ESC = b'\xc0', b'\xdb'
+SLIP_ESC_END, SLIP_ESC_ESC = b'\xdc', b'\xdd'
+
+
+class LineFramer(object):
+    """Text lines split like readline, without their terminator."""
+
+    def __init__(self, terminator=b'\r\n'):
+        """Configure the framer.
+
+        Args:
+          terminator: The bytes ending a line.  A line is split on the last
+            byte of the terminator and every terminator byte is trimmed from
+            its end, the same way readline and strip behave.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self.errors = 0
+        self._separator = terminator[-1:]
+        self._trim = frozenset(terminator)
+
+    @property
+    def separator(self):
+        """A property indicating the byte lines are split on."""
+        return self._separator
+
+    def next_frame(self, buffer, view, start, end):
+        """Return the first line in buffer[start:end], see the module."""
+        index = buffer.find(self._separator, start, end)
+        if index == -1:
+            return None
+        return self._trimmed(buffer, view, start, index + 1), index + 1
+
+    def overflow(self, data):
+        """A line longer than the buffer is handed out in pieces."""
+        return self._trimmed(data, data, 0, len(data))
+
+    def _trimmed(self, buffer, view, start, end):
+        """View of buffer[start:end] without trailing terminator bytes."""
+        while end > start and buffer[end - 1] in self._trim:
+            end -= 1
+        return view[start:end]
+
+
+class LengthPrefixFramer(object):
+    """Records preceded by their length."""
+
+    def __init__(self, header_size=2, byteorder='big', include_header=False,
+                 length_adjust=0, max_length=None):
+        """Configure the framer.
+
+        Args:
+          header_size: The size of the length field in bytes.
+          byteorder: The byte order of the length field, 'big' or 'little'.
+          include_header: Whether the frames returned include the length
+            field.
+          length_adjust: The value added to the length field to get the
+            payload size, e.g. -2 when the length counts a CRC16 trailer
+            that is part of the payload anyway.
+          max_length: The largest valid payload size.  A larger length is a
+            framing error and the framer resynchronizes one byte later.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self.errors = 0
+        self._header_size = header_size
+        self._byteorder = byteorder
+        self._include_header = include_header
+        self._length_adjust = length_adjust
+        self._max_length = max_length
+
+    def next_frame(self, buffer, view, start, end):
+        """Return the first record in buffer[start:end], see the module."""
+        header_end = start + self._header_size
+        if header_end > end:
+            return None
+        length = int.from_bytes(buffer[start:header_end], self._byteorder) + \
+            self._length_adjust
+        if length < 0 or (self._max_length is not None and
+                          length > self._max_length):
+            self.errors += 1
+            return None, start + 1
+
+        frame_end = header_end + length
+        if frame_end > end:
+            return None
+        frame_start = start if self._include_header else header_end
+        return view[frame_start:frame_end], frame_end
+
+    def overflow(self, data):
+        """A record longer than the buffer is dropped."""
+        self.errors += 1
+        return None
+
+
+class FixedSizeFramer(object):
+    """Records of a fixed size."""
+
+    def __init__(self, size):
+        """Configure the framer.
+
+        Args:
+          size: The size of each record in bytes.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self.errors = 0
+        self._size = size
+
+    def next_frame(self, buffer, view, start, end):
+        """Return the first record in buffer[start:end], see the module."""
+        if start + self._size > end:
+            return None
+        return view[start:start + self._size], start + self._size
+
+    def overflow(self, data):
+        """Never happens while the buffer is larger than a record."""
+        self.errors += 1
+        return None
+
+
+class RawFramer(object):
+    """Whatever has been received, as one frame, e.g. to relay a port."""
+
+    def __init__(self):
+        self.errors = 0
+
+    def next_frame(self, buffer, view, start, end):
+        """Return all of buffer[start:end], see the module."""
+        if start == end:
+            return None
+        return view[start:end], end
+
+    def overflow(self, data):
+        """Never happens, every fill is a frame."""
+        return data
+
+
+class SlipFramer(object):
+    """SLIP (RFC 1055) frames delimited by END bytes.
+
+    Frames without escape sequences are returned as views, the others are
+    unescaped into bytes with two bytes.replace calls.
+    """
+
+    def __init__(self):
+        self.errors = 0
+
+    def next_frame(self, buffer, view, start, end):
+        """Return the first frame in buffer[start:end], see the module."""
+        index = buffer.find(SLIP_END, start, end)
+        if index == -1:
+            return None
+        if index == start:
+            return None, index + 1
+        if buffer.find(SLIP_ESC, start, index) == -1:
+            return view[start:index], index + 1
+
+        # ESC always starts a two byte sequence, so the replacements cannot
+        # match across sequences.
+        frame = bytes(view[start:index])
+        frame = frame.replace(SLIP_ESC + SLIP_ESC_END, SLIP_END)
+        frame = frame.replace(SLIP_ESC + SLIP_ESC_ESC, SLIP_ESC)
+        return frame, index + 1
+
+    def overflow(self, data):
+        """A frame longer than the buffer is dropped."""
+        self.errors += 1
+        return None
+
+    @staticmethod
+    def encode(payload):
+        """Return the SLIP frame of a payload, END on both sides."""
+        payload = bytes(payload).replace(SLIP_ESC, SLIP_ESC + SLIP_ESC_ESC)
+        payload = payload.replace(SLIP_END, SLIP_ESC + SLIP_ESC_END)
+        return SLIP_END + payload + SLIP_END
+
+
+class CobsFramer(object):
+    """COBS frames delimited by zero bytes.
+
+    Decoding copies one block per code byte, so the Python loop runs once
+    per up to 254 bytes, not once per byte.
+    """
+
+    def __init__(self):
+        self.errors = 0
+
+    def next_frame(self, buffer, view, start, end):
+        """Return the first frame in buffer[start:end], see the module."""
+        index = buffer.find(b'\x00', start, end)
+        if index == -1:
+            return None
+        if index == start:
+            return None, index + 1
+
+        frame = self.decode(view[start:index])
+        if frame is None:
+            self.errors += 1
+        return frame, index + 1
+
+    def overflow(self, data):
+        """A frame longer than the buffer is dropped."""
+        self.errors += 1
+        return None
+
+    @staticmethod
+    def decode(data):
+        """Return the decoded payload of a frame without its delimiter, or
+        None if the frame is invalid."""
+        decoded = bytearray()
+        position = 0
+        length = len(data)
+        while position < length:
+            code = data[position]
+            block_end = position + code
+            if code == 0 or block_end > length:
+                return None
+            decoded += data[position + 1:block_end]
+            position = block_end
+            if code < 0xff and position < length:
+                decoded.append(0)
+
+        return bytes(decoded)
+
+    @staticmethod
+    def encode(payload):
+        """Return the COBS frame of a payload, with its zero delimiter."""
+        encoded = bytearray()
+        for block in bytes(payload).split(b'\x00'):
+            while len(block) >= 0xfe:
+                encoded.append(0xff)
+                encoded += block[:0xfe]
+                block = block[0xfe:]
+            encoded.append(len(block) + 1)
+            encoded += block
+        return bytes(encoded) + b'\x00'
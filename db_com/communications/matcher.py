@@ -0,0 +1,225 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a streaming matcher module.
+
+This module has classes used to look for terminators in a stream that
+arrives in pieces. Each piece is scanned once, and only a bounded amount of
+state is carried between pieces, so the cost of a search is linear in the
+length of the stream.
+
+"""
+
+
+class StreamMatcher(object):
+    """Class finds a single pattern in a stream fed piece by piece."""
+
+    def __init__(self, pattern):
+        """Configure the matcher initial values.
+
+        Args:
+          pattern: The str or bytes pattern to look for.
+        Returns:
+          None
+        Raises:
+          ValueError: The pattern is empty.
+        """
+        if not pattern:
+            raise ValueError('Pattern must not be empty.')
+        self._pattern = pattern
+        self._keep = len(pattern) - 1
+        self._tail = pattern[:0]
+        self._consumed = 0
+        self._position = -1
+
+    @property
+    def pattern(self):
+        """A property indicating the pattern."""
+        return self._pattern
+
+    @property
+    def matched(self):
+        """A property indicating whether the pattern has been seen."""
+        return self._position != -1
+
+    @property
+    def position(self):
+        """A property indicating the stream offset of the match, or -1."""
+        return self._position
+
+    def reset(self):
+        """Forget everything fed so far."""
+        self._tail = self._pattern[:0]
+        self._consumed = 0
+        self._position = -1
+
+    def feed(self, data):
+        """Scan newly arrived data.
+
+        Only the last len(pattern) - 1 elements of the previous data are
+        kept, so a pattern split across two pieces is still found.
+
+        Args:
+          data: The newly arrived str or bytes.
+        Returns:
+          True if the pattern has been seen, otherwise False.
+        Raises:
+          None
+        """
+        if self._position != -1:
+            return True
+        if not data:
+            return False
+
+        window = self._tail + data
+        index = window.find(self._pattern)
+        if index != -1:
+            self._position = self._consumed - len(self._tail) + index
+        elif self._keep:
+            self._tail = window[-self._keep:]
+        self._consumed += len(data)
+
+        return self._position != -1
+
+
+class MultiStreamMatcher(object):
+    """Class finds any of several patterns in a stream fed piece by piece.
+
+    The patterns are compiled into an Aho-Corasick automaton, so each element
+    of the stream costs one transition no matter how many patterns there
+    are. The only state carried between pieces is the automaton state.
+    """
+
+    def __init__(self, patterns):
+        """Configure the matcher initial values.
+
+        Args:
+          patterns: The list of str or bytes patterns to look for.
+        Returns:
+          None
+        Raises:
+          ValueError: The list is empty or contains an empty pattern.
+        """
+        patterns = list(patterns)
+        if not patterns or not all(patterns):
+            raise ValueError('Patterns must not be empty.')
+        self._patterns = patterns
+        self._state = 0
+        self._consumed = 0
+        self._position = -1
+        self._match = None
+        self._build()
+
+    @property
+    def patterns(self):
+        """A property indicating the patterns."""
+        return self._patterns
+
+    @property
+    def matched(self):
+        """A property indicating whether any pattern has been seen."""
+        return self._match is not None
+
+    @property
+    def match(self):
+        """A property indicating the pattern seen first, or None."""
+        return self._match
+
+    @property
+    def position(self):
+        """A property indicating the stream offset of the match, or -1."""
+        return self._position
+
+    def reset(self):
+        """Forget everything fed so far."""
+        self._state = 0
+        self._consumed = 0
+        self._position = -1
+        self._match = None
+
+    def feed(self, data):
+        """Scan newly arrived data.
+
+        Args:
+          data: The newly arrived str or bytes.
+        Returns:
+          The pattern seen first, or None if no pattern has been seen yet.
+        Raises:
+          None
+        """
+        if self._match is not None:
+            return self._match
+
+        delta = self._delta
+        output = self._output
+        state = self._state
+        for index, element in enumerate(data):
+            next_state = delta[state].get(element)
+            if next_state is None:
+                next_state = self._transition(state, element)
+            state = next_state
+            if output[state] is not None:
+                self._match = self._patterns[output[state]]
+                self._position = (self._consumed + index + 1 -
+                                  len(self._match))
+                break
+        self._state = state
+        self._consumed += len(data)
+
+        return self._match
+
+    def _build(self):
+        """Build the trie, failure links and outputs of the automaton."""
+        goto = [{}]
+        output = [None]
+        for number, pattern in enumerate(self._patterns):
+            state = 0
+            for element in pattern:
+                if element not in goto[state]:
+                    goto.append({})
+                    output.append(None)
+                    goto[state][element] = len(goto) - 1
+                state = goto[state][element]
+            if output[state] is None:
+                output[state] = number
+
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for element, child in goto[state].items():
+                queue.append(child)
+                fallback = fail[state]
+                while fallback and element not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[child] = goto[fallback].get(element, 0)
+                if fail[child] == child:
+                    fail[child] = 0
+                if output[child] is None:
+                    output[child] = output[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+        self._delta = [dict(edges) for edges in goto]
+
+    def _transition(self, state, element):
+        """Resolve and memoize a transition missing from the trie."""
+        fallback = state
+        while fallback and element not in self._goto[fallback]:
+            fallback = self._fail[fallback]
+        next_state = self._goto[fallback].get(element, 0)
+        self._delta[state][element] = next_state
+
+        return next_state
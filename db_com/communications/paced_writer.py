@@ -0,0 +1,221 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a paced writer module.
+
+This module has a class used to write bytes to a Serial slowly, for devices
+that drop characters sent back to back such as bootloaders. A writer thread
+cuts the data into chunks and sends each when a token bucket allows it. Send
+times follow the bucket schedule, so a late chunk does not delay the next
+ones, and how late each chunk was is recorded as the pacing jitter.
+
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db_com.communications.port_stats import LatencyHistogram
+
+# Sleeping is only accurate to about a millisecond, the last SPIN_TIME
+# seconds before a chunk is due are spent polling the clock.
+SPIN_TIME = 0.001
+
+
+class PacedWriter(object):
+    """Class writes bytes to a Serial from a writer thread, paced by a token
+    bucket of rate bytes per second."""
+
+    def __init__(self, serial_port, rate=None, chunk_size=1, burst=None,
+                 jitter=None, maxsize=0):
+        """Configure the writer initial values.
+
+        Args:
+          serial_port: The open Serial to write to.
+          rate: The bytes per second, None for no pacing.
+          chunk_size: The bytes written at once, e.g. the block size of a
+            bootloader.
+          burst: The most bytes written back to back after the writer was
+            idle, default chunk_size.
+          jitter: The LatencyHistogram recording how late each chunk is
+            written, default a new one.
+          maxsize: The most writes queued, 0 for no limit.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._serial = serial_port
+        self._rate = rate
+        self._chunk_size = chunk_size
+        self._burst = burst
+        self._jitter = jitter if jitter is not None else LatencyHistogram()
+        self._maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._writer_thread = None
+        self._writer_alive = False
+        self._stopping = threading.Event()
+        self._tokens = 0.0
+        self._refill_time = 0.0
+        self._written = 0
+        self._chunks = 0
+        self._failed = 0
+
+    @property
+    def alive(self):
+        """A property indicating whether the writer thread runs."""
+        return self._writer_alive
+
+    @property
+    def jitter(self):
+        """A property containing the LatencyHistogram of the pacing."""
+        return self._jitter
+
+    def metrics(self):
+        """Return dict of queue depth, bytes and chunks written and the
+        pacing jitter in seconds."""
+        return {'queue_depth': self._queue.qsize(), 'written': self._written,
+                'chunks': self._chunks, 'failed': self._failed,
+                'jitter': self._jitter.snapshot()}
+
+    def send(self, data, rate=None, chunk_size=None):
+        """Queue bytes without waiting for them to be written.
+
+        Args:
+          data: The bytes to be written.
+          rate: The bytes per second of this write, default the rate of the
+            writer.
+          chunk_size: The bytes written at once, default the chunk size of
+            the writer.
+        Returns:
+          Future of dict of the bytes written, seconds taken and the largest
+            jitter.  The future is cancelled when the writer stops first.
+        Raises:
+          queue.Full: maxsize writes are already waiting.
+        """
+        future = Future()
+        self._queue.put_nowait((bytes(data), rate or self._rate,
+                                chunk_size or self._chunk_size, future))
+
+        return future
+
+    def start(self):
+        """Start writer thread."""
+        if self._writer_alive:
+            return
+        self._writer_alive = True
+        self._stopping.clear()
+        self._queue = queue.Queue(self._maxsize)
+        self._writer_thread = threading.Thread(target=self.writer,
+                                               args=(self._queue,),
+                                               name='Serial_Paced_Tx')
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def stop(self, timeout=None):
+        """Stop writer thread, cancelling the writes not finished.
+
+        Args:
+          timeout: The most seconds to wait for the thread, default until it
+            exits.  A chunk being written is not interrupted.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if not self._writer_alive:
+            return
+        self._writer_alive = False
+        self._stopping.set()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            item[3].cancel()
+        self._queue.put(None)
+        self._writer_thread.join(timeout)
+
+    def writer(self, writes):
+        """Thread function, writing queued bytes chunk by chunk.
+
+        Args:
+          writes: The queue of the thread.
+        """
+        while True:
+            item = writes.get()
+            if item is None:
+                break
+            data, rate, chunk_size, future = item
+
+            try:
+                result = self._write(data, rate, chunk_size)
+            except Exception as error:
+                self._failed += 1
+                logging.error('paced write failed : {}'.format(error))
+                future.set_exception(error)
+                continue
+            if result is None:
+                future.cancel()
+            else:
+                future.set_result(result)
+
+    def _write(self, data, rate, chunk_size):
+        """Write data paced, return dict of the write or None when stopped."""
+        session = self._serial.session
+        burst = max(self._burst or chunk_size, chunk_size)
+        start = time.monotonic()
+        largest = 0.0
+        for offset in range(0, len(data), chunk_size):
+            chunk = data[offset:offset + chunk_size]
+            due = self._schedule(len(chunk), rate, burst)
+            if not self._wait_until(due):
+                return None
+            late = time.monotonic() - due
+            session.write(chunk)
+            self._jitter.record(late)
+            largest = max(largest, late)
+            self._written += len(chunk)
+            self._chunks += 1
+
+        return {'bytes': len(data), 'seconds': time.monotonic() - start,
+                'max_jitter': largest}
+
+    def _schedule(self, size, rate, burst):
+        """Take size tokens from the bucket, return when they are due."""
+        now = time.monotonic()
+        if rate is None:
+            return now
+        # The tokens go negative while waiting, so each chunk is due from
+        # the previous one's due time rather than from when it was sent.
+        tokens = min(burst, self._tokens + (now - self._refill_time) * rate)
+        self._tokens = tokens - size
+        self._refill_time = now
+
+        return now + max(0.0, -self._tokens) / rate
+
+    def _wait_until(self, due):
+        """Wait for a monotonic time, return False when stopped first."""
+        while True:
+            remaining = due - time.monotonic()
+            if remaining <= 0:
+                return True
+            if remaining > SPIN_TIME:
+                if self._stopping.wait(remaining - SPIN_TIME):
+                    return False
+            elif self._stopping.is_set():
+                return False
@@ -0,0 +1,216 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a multi-port manager module.
+
+This module has a class used to read many Serial ports from a single
+selector loop, instead of one read thread per port.
+
+"""
+
+import logging
+import os
+import selectors
+import threading
+import time
+from collections import OrderedDict
+
+import serial
+
+
+class PortLatency(object):
+    """Class keeps the event-loop latency of one port.
+
+    The latency is the time from the loop waking up with the port readable to
+    the port's data being dispatched, so it grows when other ports' handlers
+    are slow.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.last = 0.0
+        self.max = 0.0
+        self.total = 0.0
+
+    def add(self, latency):
+        """Record one dispatch latency in seconds."""
+        self.count += 1
+        self.last = latency
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def snapshot(self):
+        """Return dict of the recorded latency in seconds."""
+        mean = self.total / self.count if self.count else 0.0
+        return {'count': self.count, 'last': self.last, 'max': self.max,
+                'mean': mean}
+
+
+class PortManager(object):
+    """Class reads many Serial sessions from one selector thread."""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._ports = OrderedDict()
+        self._latency = OrderedDict()
+        self._lock = threading.Lock()
+        # Held by the loop while it dispatches a port, so close never pulls
+        # the session from under a dispatch.  Reentrant for handlers that
+        # close ports.
+        self._dispatch_lock = threading.RLock()
+        self._wakeup = os.pipe()
+        self._thread = None
+        self._alive = False
+
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+
+    def open(self, serial_port):
+        """Open a Serial and read it from the manager loop.
+
+        Args:
+          serial_port: The Serial to open, with its read_handler set.
+        Returns:
+          None
+        Raises:
+          ValueError: The port is already managed or has no read handler.
+        """
+        if serial_port.port in self._ports:
+            raise ValueError('{} is already open.'.format(serial_port.port))
+        if not serial_port.read_handler:
+            raise ValueError('{} has no read handler.'.format(serial_port.port))
+
+        serial_port.open(start_reader=False)
+        with self._lock:
+            self._ports[serial_port.port] = serial_port
+            self._latency[serial_port.port] = PortLatency()
+            self._selector.register(serial_port.session.fileno(),
+                                    selectors.EVENT_READ, serial_port)
+        self._wake()
+        logging.debug('Manager opened {}'.format(serial_port.port))
+
+        if not self._alive:
+            self._start()
+
+    def close(self, port):
+        """Stop reading a port and close it.
+
+        Args:
+          port: The port name.
+        Returns:
+          None
+        Raises:
+          KeyError: The port is not managed.
+        """
+        with self._lock:
+            serial_port = self._ports.pop(port)
+            self._latency.pop(port)
+            self._unregister(serial_port)
+        self._wake()
+        with self._dispatch_lock:
+            serial_port.close()
+        logging.debug('Manager closed {}'.format(port))
+
+    def close_all(self):
+        """Close every port and stop the manager loop."""
+        for port in list(self._ports):
+            self.close(port)
+        self._stop()
+
+    def ports(self):
+        """List of the managed port names."""
+        return list(self._ports)
+
+    def serial(self, port):
+        """The Serial of a managed port."""
+        return self._ports[port]
+
+    def latency(self, port=None):
+        """Event-loop latency of a port, or of every port.
+
+        Args:
+          port: The port name, default every port.
+        Returns:
+          dict of count, last, max and mean latency in seconds, or a dict of
+            those keyed by port name.
+        Raises:
+          KeyError: The port is not managed.
+        """
+        if port is not None:
+            return self._latency[port].snapshot()
+        return OrderedDict((name, latency.snapshot())
+                           for name, latency in list(self._latency.items()))
+
+    def run(self):
+        """Thread function, dispatching every readable port."""
+        while self._alive:
+            events = self._selector.select()
+            woken = time.monotonic()
+            for key, _ in events:
+                serial_port = key.data
+                if serial_port is None:
+                    os.read(self._wakeup[0], 512)
+                    continue
+
+                with self._dispatch_lock:
+                    self._dispatch(serial_port, woken)
+
+    def _dispatch(self, serial_port, woken):
+        """Dispatch a readable port, unless it was closed since the select.
+
+        A failed port is closed, a failing read handler is only logged, so
+        one port never stops the loop for the others.
+        """
+        with self._lock:
+            if self._ports.get(serial_port.port) is not serial_port:
+                return
+            latency = self._latency[serial_port.port]
+        latency.add(time.monotonic() - woken)
+        try:
+            serial_port.dispatch()
+        except serial.SerialException as error:
+            logging.error('{} : {}'.format(serial_port.port, error))
+            with self._lock:
+                self._ports.pop(serial_port.port, None)
+                self._latency.pop(serial_port.port, None)
+                self._unregister(serial_port)
+            serial_port.close()
+        except Exception:
+            logging.exception('{} dispatch failed'.format(serial_port.port))
+
+    def _start(self):
+        """Start the manager thread."""
+        self._alive = True
+        self._thread = threading.Thread(target=self.run, name='PortManager_Rx')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _stop(self):
+        """Stop the manager thread, wait for clean exit of thread."""
+        if not self._alive:
+            return
+        self._alive = False
+        self._wake()
+        self._thread.join()
+
+    def _wake(self):
+        """Interrupt the select so the loop sees the change."""
+        os.write(self._wakeup[1], b'x')
+
+    def _unregister(self, serial_port):
+        """Remove the port from the selector, if it is still registered."""
+        for key in list(self._selector.get_map().values()):
+            if key.data is serial_port:
+                self._selector.unregister(key.fileobj)
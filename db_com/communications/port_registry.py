@@ -0,0 +1,211 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a port registry module.
+
+This module has a class used to keep the list of serial ports without
+scanning every tty in sysfs each time it is needed. The ports are scanned
+once, then a watcher thread follows device nodes created and deleted in
+/dev with inotify and looks up only those. Where inotify is not available
+the watcher rescans every POLL_INTERVAL seconds instead.
+
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import struct
+import threading
+
+from serial.tools import list_ports
+
+try:
+    from serial.tools.list_ports_linux import SysFS
+except ImportError:
+    SysFS = None
+
+DEVICE_DIRECTORY = '/dev'
+# The device names list_ports.comports looks for on Linux.
+DEVICE_PATTERNS = ('ttyS*', 'ttyUSB*', 'ttyXRUSB*', 'ttyACM*', 'ttyAMA*',
+                   'rfcomm*', 'ttyAP*')
+POLL_INTERVAL = 2.0
+
+IN_NONBLOCK, IN_CLOEXEC = os.O_NONBLOCK, 0o2000000
+IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW = \
+    0x100, 0x200, 0x40, 0x80, 0x4000
+_EVENT = struct.Struct('iIII')
+
+
+def _inotify():
+    """Return an inotify fd watching DEVICE_DIRECTORY, or None."""
+    if SysFS is None:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fileno = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fileno < 0:
+        return None
+    mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+    if libc.inotify_add_watch(fileno, DEVICE_DIRECTORY.encode(), mask) < 0:
+        os.close(fileno)
+        return None
+
+    return fileno
+
+
+class PortRegistry(object):
+    """Class caches the serial ports and follows hot-plug events."""
+
+    def __init__(self, added_handler=None, removed_handler=None):
+        """Configure the registry initial values.
+
+        Args:
+          added_handler: The handler called with each port info added, from
+            the watcher thread.
+          removed_handler: The handler called with each device name removed,
+            from the watcher thread.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._added_handler = added_handler
+        self._removed_handler = removed_handler
+        self._ports = {}
+        self._lock = threading.Lock()
+        self._watcher_thread = None
+        self._watcher_alive = False
+        self._wakeup = None
+        self._scan_requested = False
+
+    def ports(self):
+        """Return the cached list of port infos, sorted by device."""
+        with self._lock:
+            return sorted(self._ports.values(), key=lambda port: port.device)
+
+    def scan(self):
+        """Scan every port and report the differences with the cache."""
+        found = {port.device: port for port in list_ports.comports()}
+        with self._lock:
+            added = [port for device, port in found.items()
+                     if device not in self._ports]
+            removed = [device for device in self._ports
+                       if device not in found]
+            self._ports = found
+        self._notify(added, removed)
+
+    def request_scan(self):
+        """Ask the watcher thread for a scan without waiting for it."""
+        if not self._watcher_alive:
+            self.scan()
+            return
+        self._scan_requested = True
+        os.write(self._wakeup[1], b'x')
+
+    def start(self):
+        """Start watcher thread, which scans first."""
+        if self._watcher_alive:
+            return
+        self._watcher_alive = True
+        self._wakeup = os.pipe()
+        self._watcher_thread = threading.Thread(target=self.watcher,
+                                                name='PortRegistry')
+        self._watcher_thread.daemon = True
+        self._watcher_thread.start()
+
+    def stop(self):
+        """Stop watcher thread."""
+        if not self._watcher_alive:
+            return
+        self._watcher_alive = False
+        os.write(self._wakeup[1], b'x')
+        self._watcher_thread.join()
+        for fileno in self._wakeup:
+            os.close(fileno)
+        self._wakeup = None
+
+    def watcher(self):
+        """Thread function, following ports added and removed."""
+        inotify = _inotify()
+        if inotify is None:
+            logging.debug('No inotify, polling serial ports.')
+        waits = [self._wakeup[0]] + ([inotify] if inotify is not None else [])
+        timeout = None if inotify is not None else POLL_INTERVAL
+        try:
+            self.scan()
+            while self._watcher_alive:
+                readable, _, _ = select.select(waits, [], [], timeout)
+                if self._wakeup[0] in readable:
+                    os.read(self._wakeup[0], 512)
+                if inotify is None or self._scan_requested:
+                    self._scan_requested = False
+                    self.scan()
+                elif inotify in readable:
+                    self._read_events(inotify)
+        finally:
+            if inotify is not None:
+                os.close(inotify)
+
+    def _read_events(self, inotify):
+        """Look up the devices of the pending inotify events."""
+        changed = set()
+        try:
+            data = os.read(inotify, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\x00')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.scan()
+                return
+            name = os.fsdecode(name)
+            if any(fnmatch.fnmatchcase(name, pattern)
+                   for pattern in DEVICE_PATTERNS):
+                changed.add(os.path.join(DEVICE_DIRECTORY, name))
+
+        added, removed = [], []
+        for device in sorted(changed):
+            port = SysFS(device) if os.path.exists(device) else None
+            if port is not None and port.subsystem == 'platform':
+                # Not present, as list_ports.comports filters them.
+                port = None
+            with self._lock:
+                if port is not None:
+                    if device not in self._ports:
+                        added.append(port)
+                    self._ports[device] = port
+                elif self._ports.pop(device, None) is not None:
+                    removed.append(device)
+        self._notify(added, removed)
+
+    def _notify(self, added, removed):
+        """Call the handlers for the ports added and removed."""
+        for device in removed:
+            logging.debug('Port removed : {}'.format(device))
+            if self._removed_handler is not None:
+                self._removed_handler(device)
+        for port in added:
+            logging.debug('Port added : {}'.format(port.device))
+            if self._added_handler is not None:
+                self._added_handler(port)
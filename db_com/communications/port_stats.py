@@ -0,0 +1,140 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a port statistics module.
+
+This module has classes used to count the I/O of a Serial and record its
+query latencies. Each counter is only written by one thread and read
+without a lock, so updating them costs a few additions and a snapshot never
+blocks the I/O threads.
+
+"""
+
+from array import array
+
+# Latencies are recorded in microseconds, with SUB_BUCKET_BITS significant
+# bits, i.e. within 1/64 of the value.
+SUB_BUCKET_BITS = 7
+HIGHEST_EXPONENT = 34
+
+
+class LatencyHistogram(object):
+    """HDR-style histogram of latencies with log-linear buckets."""
+
+    def __init__(self):
+        self._half = 1 << (SUB_BUCKET_BITS - 1)
+        self._counts = array('q', bytes(8 * self._half *
+                                        (HIGHEST_EXPONENT + 2)))
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def _index(self, value):
+        """Return the bucket of a value in microseconds."""
+        exponent = max(0, value.bit_length() - SUB_BUCKET_BITS)
+        exponent = min(exponent, HIGHEST_EXPONENT)
+        if not exponent:
+            return value
+        return self._half * exponent + min(value >> exponent,
+                                           2 * self._half - 1)
+
+    def _value(self, index):
+        """Return the middle of a bucket in microseconds."""
+        if index < 2 * self._half:
+            return index
+        exponent = index // self._half - 1
+        return ((index - self._half * exponent) << exponent) + \
+            (1 << exponent) // 2
+
+    def record(self, latency):
+        """Record a latency in seconds."""
+        self._counts[self._index(int(latency * 1e6))] += 1
+        self.count += 1
+        self.total += latency
+        if self.min is None or latency < self.min:
+            self.min = latency
+        if latency > self.max:
+            self.max = latency
+
+    def reset(self):
+        """Drop all latencies."""
+        for index in range(len(self._counts)):
+            self._counts[index] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def snapshot(self, points=(50, 90, 99, 99.9)):
+        """Return dict of count, mean, min, max and percentiles in seconds."""
+        counts = array('q', self._counts)
+        count = sum(counts)
+        result = {'count': count, 'mean': self.total / count if count else 0.0,
+                  'min': self.min or 0.0, 'max': self.max}
+        targets = [(point, point / 100.0 * count) for point in points]
+        seen = 0
+        for index, bucket in enumerate(counts):
+            if not bucket:
+                continue
+            seen += bucket
+            while targets and seen >= targets[0][1]:
+                result['p{:g}'.format(targets[0][0])] = \
+                    min(self._value(index) / 1e6, self.max)
+                targets.pop(0)
+            if not targets:
+                break
+        for point, _ in targets:
+            result['p{:g}'.format(point)] = 0.0
+
+        return result
+
+
+class PortStats(object):
+    """Class holds the I/O counters of a Serial.
+
+    The read thread updates the in counters and handler time, the writing
+    thread the out counters and query latencies, and the PacedWriter thread
+    the pacing jitter.
+    """
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lines_in = 0
+        self.lines_out = 0
+        self.reads = 0
+        self.writes = 0
+        self.handler_time = 0.0
+        self.query_latency = LatencyHistogram()
+        self.pacing_jitter = LatencyHistogram()
+
+    def reset(self):
+        """Zero every counter."""
+        self.bytes_in = self.bytes_out = 0
+        self.lines_in = self.lines_out = 0
+        self.reads = self.writes = 0
+        self.handler_time = 0.0
+        self.query_latency.reset()
+        self.pacing_jitter.reset()
+
+    def snapshot(self):
+        """Return dict of the counters, without locking."""
+        return {'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                'lines_in': self.lines_in, 'lines_out': self.lines_out,
+                'reads': self.reads, 'writes': self.writes,
+                'handler_time': self.handler_time,
+                'query_latency': self.query_latency.snapshot(),
+                'pacing_jitter': self.pacing_jitter.snapshot()}
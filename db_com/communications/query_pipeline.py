@@ -0,0 +1,334 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a pipelined query module.
+
+This module has classes used to keep several commands in flight on one
+Serial, instead of the write, sleep, read round trip of Serial.query.
+Responses are matched to their commands by a correlation rule, and each
+command returns a future.
+
+"""
+
+import itertools
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+
+from db_com.communications.receive_buffer import ReceiveBuffer
+
+
+class OrderCorrelation(object):
+    """Responses come back in the order the commands were sent."""
+
+    def command(self, command, sequence):
+        """Return the command to send for a request.
+
+        Args:
+          command: The command given by the caller.
+          sequence: The sequence number of the request.
+        Returns:
+          The command to write to the device.
+        """
+        return command
+
+    def match(self, line, pending):
+        """Find the request a received line belongs to.
+
+        Args:
+          line: The received line.
+          pending: OrderedDict of sequence number to request, oldest first.
+        Returns:
+          (sequence, response), or None if the line belongs to no request.
+        """
+        for sequence in pending:
+            return sequence, line
+        return None
+
+
+class EchoCorrelation(object):
+    """The device echoes each command before answering it.
+
+    Lines are ignored until the echo of a pending command is seen, and the
+    lines after it belong to that command.
+    """
+
+    def __init__(self):
+        self._echoed = None
+
+    def command(self, command, sequence):
+        """Return the command to send for a request, see OrderCorrelation."""
+        return command
+
+    def match(self, line, pending):
+        """Find the request a received line belongs to, see
+        OrderCorrelation."""
+        for sequence, request in pending.items():
+            if line.strip() == request.command.strip():
+                self._echoed = sequence
+                return None
+        if self._echoed in pending:
+            return self._echoed, line
+        return None
+
+
+class TagCorrelation(object):
+    """Each command carries a tag that the device repeats in its response.
+
+    The tag is the request sequence number.
+    """
+
+    def __init__(self, command_format='{tag} {command}',
+                 response_pattern=r'^(?P<tag>\d+)\s*(?P<response>.*)$'):
+        """Configure the tag format.
+
+        Args:
+          command_format: The format of the command sent, with {tag} and
+            {command} fields.
+          response_pattern: The regular expression of a tagged response,
+            with groups tag and response.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._command_format = command_format
+        self._response_pattern = re.compile(response_pattern)
+
+    def command(self, command, sequence):
+        """Return the command to send for a request, see OrderCorrelation."""
+        return self._command_format.format(tag=sequence, command=command)
+
+    def match(self, line, pending):
+        """Find the request a received line belongs to, see
+        OrderCorrelation."""
+        matched = self._response_pattern.match(line)
+        if not matched:
+            return None
+        sequence = int(matched.group('tag'))
+        if sequence not in pending:
+            return None
+        return sequence, matched.group('response')
+
+
+class QueryRequest(object):
+    """Class keeps one command in flight."""
+
+    def __init__(self, command, sequence):
+        self.command = command
+        self.sequence = sequence
+        self.future = Future()
+        self.lines = []
+        self.sent_time = time.monotonic()
+
+
+class QueryPipeline(object):
+    """Class keeps up to depth commands in flight on one Serial.
+
+    The pipeline becomes the read handler of the Serial, so create it before
+    opening the port, or open the port through PortManager.
+    """
+
+    def __init__(self, serial_port, depth=8, correlation=None,
+                 response_end=None, timeout=None, unmatched_handler=None):
+        """Configure the pipeline initial values.
+
+        Args:
+          serial_port: The Serial the commands are sent to.
+          depth: The most commands in flight at once.
+          correlation: The correlation rule, OrderCorrelation,
+            EchoCorrelation or TagCorrelation.  Default OrderCorrelation.
+          response_end: List of the lines ending a multi-line response, e.g.
+            ['OK', 'ERROR'].  By default each response is one line.
+          timeout: Seconds after which a request without response fails with
+            TimeoutError, default never.  Requests are expired by a timer
+            thread, so a silent device cannot hold them.
+          unmatched_handler: The handler of received lines matching no
+            request.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._serial = serial_port
+        self._correlation = correlation or OrderCorrelation()
+        self._response_end = set(response_end) if response_end else None
+        self._timeout = timeout
+        self._unmatched_handler = unmatched_handler
+        self._slots = threading.BoundedSemaphore(depth)
+        # Notified when a request is added, for the expiry thread.
+        self._lock = threading.Condition()
+        self._pending = OrderedDict()
+        self._sequence = itertools.count()
+        self._expiry_thread = None
+        self._expiry_alive = False
+
+        self._serial.read_handler = self._on_line
+
+    @property
+    def in_flight(self):
+        """A property indicating the number of commands in flight."""
+        return len(self._pending)
+
+    def submit(self, command):
+        """Send a command without waiting for its response.
+
+        Blocks while depth commands are already in flight, at most the
+        timeout.
+
+        Args:
+          command: The command that is sent to the device.
+        Returns:
+          future: concurrent.futures.Future of the response.
+        Raises:
+          TimeoutError: No command in flight finished within the timeout.
+        """
+        if not self._slots.acquire(timeout=self._timeout):
+            raise TimeoutError('{} commands still in flight'.format(
+                len(self._pending)))
+        if self._timeout is not None and not self._expiry_alive:
+            self._start_expiry()
+        with self._lock:
+            request = QueryRequest(command, next(self._sequence))
+            self._pending[request.sequence] = request
+            self._lock.notify()
+        request.future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            self._serial.write(self._correlation.command(command,
+                                                         request.sequence))
+        except Exception as error:
+            self._finish(request, error=error)
+
+        return request.future
+
+    def query_all(self, commands):
+        """Send every command pipelined and wait for all responses.
+
+        Args:
+          commands: The list of commands.
+        Returns:
+          List of the responses, in the order of the commands.
+        Raises:
+          TimeoutError: A response did not arrive within the timeout.
+        """
+        futures = [self.submit(command) for command in commands]
+        if self._timeout is None:
+            return [future.result() for future in futures]
+
+        # Every command is sent, so each expires before this deadline.
+        deadline = time.monotonic() + self._timeout
+        return [future.result(max(0, deadline - time.monotonic()))
+                for future in futures]
+
+    def close(self):
+        """Cancel every command in flight and stop the expiry thread."""
+        with self._lock:
+            requests = list(self._pending.values())
+            self._pending.clear()
+            self._expiry_alive = False
+            self._lock.notify()
+        if self._expiry_thread is not None:
+            self._expiry_thread.join()
+            self._expiry_thread = None
+        for request in requests:
+            request.future.cancel()
+
+    def expiry(self):
+        """Thread function, failing each request when its timeout passes.
+
+        Requests are pending in the order they were sent, so only the
+        oldest is waited for.
+        """
+        while True:
+            with self._lock:
+                while self._expiry_alive:
+                    if not self._pending:
+                        self._lock.wait()
+                        continue
+                    oldest = next(iter(self._pending.values()))
+                    remaining = oldest.sent_time + self._timeout - \
+                        time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._lock.wait(remaining)
+                if not self._expiry_alive:
+                    return
+            self._expire()
+
+    def _start_expiry(self):
+        """Start expiry thread."""
+        self._expiry_alive = True
+        self._expiry_thread = threading.Thread(target=self.expiry,
+                                               name='QueryPipeline_Expiry')
+        self._expiry_thread.daemon = True
+        self._expiry_thread.start()
+
+    def _on_line(self, line):
+        """Read handler, hand the line to the request it belongs to."""
+        if not isinstance(line, str):
+            line = ReceiveBuffer.decode(line)
+        self._expire()
+
+        with self._lock:
+            matched = self._correlation.match(line, self._pending)
+            if matched is None:
+                request = None
+            else:
+                request = self._pending[matched[0]]
+                request.lines.append(matched[1])
+                if self._response_end is not None and \
+                        matched[1].strip() not in self._response_end:
+                    request = None
+                else:
+                    del self._pending[request.sequence]
+
+        if matched is None:
+            if self._unmatched_handler:
+                self._unmatched_handler(line)
+            else:
+                logging.debug('unmatched : %s', line)
+        elif request is not None:
+            self._finish(request, result='\n'.join(request.lines))
+
+    def _expire(self):
+        """Fail the requests older than the timeout."""
+        if self._timeout is None:
+            return
+
+        deadline = time.monotonic() - self._timeout
+        expired = []
+        with self._lock:
+            for sequence, request in list(self._pending.items()):
+                if request.sent_time >= deadline:
+                    break
+                expired.append(self._pending.pop(sequence))
+        for request in expired:
+            self._finish(request, error=TimeoutError(
+                'No response to {}'.format(request.command)))
+
+    def _finish(self, request, result=None, error=None):
+        """Resolve the future of a request."""
+        with self._lock:
+            self._pending.pop(request.sequence, None)
+        if request.future.done():
+            return
+        if error is not None:
+            request.future.set_exception(error)
+        else:
+            request.future.set_result(result)
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a receive buffer module.
+
+This module has a class used to collect received bytes in a preallocated
+buffer and hand them out as frames, memoryview slices without copying.
+
+"""
+
+from db_com.communications.framers import LineFramer
+
+
+class ReceiveBuffer(object):
+    """Class keeps received bytes in one preallocated bytearray.
+
+    Data is read straight into the free end of the buffer. Unconsumed data is
+    moved back to the front before the next read, so views handed out are
+    only valid until the next call to fill.
+    """
+
+    def __init__(self, size=65536, framer=None):
+        """Configure the buffer initial values.
+
+        Args:
+          size: The capacity of the buffer in bytes.
+          framer: The framer cutting the data into frames, see the framers
+            module.  Default LineFramer with a '\\r\\n' terminator.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._framer = framer or LineFramer()
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def capacity(self):
+        """A property indicating the capacity of the buffer."""
+        return len(self._buffer)
+
+    @property
+    def framer(self):
+        """A property indicating the framer."""
+        return self._framer
+
+    @staticmethod
+    def decode(data):
+        """Decode received bytes to text, the way Serial always has."""
+        return str(data, 'utf-8', 'ignore').strip('\x00')
+
+    def clear(self):
+        """Drop all unconsumed data."""
+        self._start = 0
+        self._end = 0
+
+    def fill(self, session, size=None):
+        """Read from the session into the free end of the buffer.
+
+        Args:
+          session: The object providing readinto, e.g. serial.Serial.
+          size: The most bytes to read, default all free space.
+        Returns:
+          count: Number of bytes read.
+        Raises:
+          None
+        """
+        self._compact()
+        free = len(self._buffer) - self._end
+        if size is not None:
+            free = min(free, size)
+        if free <= 0:
+            return 0
+
+        count = session.readinto(self._view[self._end:self._end + free]) or 0
+        self._end += count
+
+        return count
+
+    def frames(self):
+        """Generate and consume every complete frame.
+
+        If the buffer is full without a complete frame, its content goes to
+        the overflow method of the framer so reading can go on.
+
+        Returns:
+          A generator of the frames, mostly memoryview.
+        """
+        buffer = self._buffer
+        view = self._view
+        next_frame = self._framer.next_frame
+        while self._start < self._end:
+            found = next_frame(buffer, view, self._start, self._end)
+            if found is None:
+                if self._start or self._end < len(buffer):
+                    return
+                frame = self._framer.overflow(view[self._start:self._end])
+                self._start = self._end
+            else:
+                frame, self._start = found
+            if frame is not None:
+                yield frame
+
+    def take(self, size=None):
+        """Consume unconsumed data.
+
+        Args:
+          size: The most bytes to consume, default all.
+        Returns:
+          A memoryview of the data.
+        """
+        end = self._end
+        if size is not None:
+            end = min(end, self._start + size)
+        data = self._view[self._start:end]
+        self._start = end
+
+        return data
+
+    def peek(self):
+        """Return a memoryview of the unconsumed data, without consuming
+        it."""
+        return self._view[self._start:self._end]
+
+    def find(self, sub, start=0):
+        """Return the offset of sub in the unconsumed data from start, or
+        -1."""
+        index = self._buffer.find(sub, self._start + start, self._end)
+        return index if index == -1 else index - self._start
+
+    def last(self, count):
+        """Return a memoryview of the last count bytes filled, consumed or
+        not."""
+        return self._view[self._end - count:self._end]
+
+    def _compact(self):
+        """Move unconsumed data to the front of the buffer."""
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._start:
+            length = self._end - self._start
+            self._buffer[:length] = bytes(self._view[self._start:self._end])
+            self._start, self._end = 0, length
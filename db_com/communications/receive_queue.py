@@ -0,0 +1,264 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a receive queue module.
+
+This module has a class used to decouple the read thread of Serial from a
+slow read handler. The reader only puts data into a bounded queue, and a
+dispatch thread calls the handler. What happens when the queue is full is
+chosen by a policy.
+
+"""
+
+import logging
+import os
+import struct
+import tempfile
+import threading
+from collections import deque
+
+from db_com.communications.checksum import TaggedFrame
+
+POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_SPILL = \
+    'block', 'drop_oldest', 'drop_newest', 'spill'
+
+_RECORD = struct.Struct('<BI')
+_KIND_BYTES, _KIND_STR, _KIND_VALID, _KIND_INVALID = 0, 1, 2, 3
+
+
+class ReceiveQueue(object):
+    """Class queues read data and hands it to a handler from its own thread.
+
+    An instance is used as the read_handler of Serial, which starts and
+    stops it with its read thread.
+    """
+
+    def __init__(self, handler, maxsize=10000, policy=POLICY_BLOCK,
+                 spill_path=None, stopped_handler=None):
+        """Configure the queue initial values.
+
+        Args:
+          handler: The slow handler called from the dispatch thread.
+          maxsize: The most items held in memory.
+          policy: What to do when the queue is full.  POLICY_BLOCK waits for
+            room, POLICY_DROP_OLDEST drops the oldest item, POLICY_DROP_NEWEST
+            drops the new item and POLICY_SPILL appends it to a spill file
+            read back in order once the handler catches up.
+          spill_path: The spill file, default a temporary file.
+          stopped_handler: The handler called without arguments from the
+            dispatch thread as it exits, e.g. to close what handler writes
+            to.
+        Returns:
+          None
+        Raises:
+          ValueError: The policy is unknown.
+        """
+        if policy not in (POLICY_BLOCK, POLICY_DROP_OLDEST,
+                          POLICY_DROP_NEWEST, POLICY_SPILL):
+            raise ValueError('Unknown policy {}.'.format(policy))
+
+        self._handler = handler
+        self._stopped_handler = stopped_handler
+        self._maxsize = maxsize
+        self._policy = policy
+        self._spill_path = spill_path
+        self._spill_file = None
+        self._spill_read = 0
+        self._spilled = 0
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._dispatch_thread = None
+        self._dispatch_alive = False
+        self._draining = False
+        self._overflows = 0
+        self._high_water_mark = 0
+        self._dropped_items = 0
+        self._dropped_bytes = 0
+        self._spilled_total = 0
+
+    def __call__(self, data):
+        self.put(data)
+
+    @property
+    def policy(self):
+        """A property indicating the overflow policy."""
+        return self._policy
+
+    def metrics(self):
+        """Return dict of queue depth and overflow counters."""
+        return {'depth': len(self._items), 'spilled': self._spilled,
+                'high_water_mark': self._high_water_mark,
+                'overflows': self._overflows,
+                'dropped_items': self._dropped_items,
+                'dropped_bytes': self._dropped_bytes,
+                'spilled_total': self._spilled_total}
+
+    def put(self, data):
+        """Queue data read by the read thread.
+
+        memoryview data is copied, since the receive buffer reuses it.
+
+        Args:
+          data: The str, bytes, memoryview or TaggedFrame read.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        elif isinstance(data, TaggedFrame) and \
+                isinstance(data.payload, memoryview):
+            data = TaggedFrame(bytes(data.payload), data.valid)
+
+        with self._condition:
+            if self._spilled or len(self._items) >= self._maxsize:
+                if not self._overflow(data):
+                    return
+            self._items.append(data)
+            if len(self._items) > self._high_water_mark:
+                self._high_water_mark = len(self._items)
+            self._condition.notify_all()
+
+    def start(self):
+        """Start dispatch thread, after a draining one has finished."""
+        if self._dispatch_alive:
+            return
+        if self._dispatch_thread is not None:
+            self._dispatch_thread.join()
+        self._dispatch_alive = True
+        self._draining = False
+        self._dispatch_thread = threading.Thread(target=self.dispatcher,
+                                                 name='Serial_Dispatch')
+        self._dispatch_thread.daemon = True
+        self._dispatch_thread.start()
+
+    def stop(self, timeout=None, drain=False):
+        """Stop dispatch thread, the queued data is kept unless drained.
+
+        Args:
+          timeout: The most seconds to wait for the thread, 0 to return at
+            once.
+          drain: Whether the thread hands every queued item to the handler
+            before it exits.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if not self._dispatch_alive:
+            return
+        with self._condition:
+            self._dispatch_alive = False
+            self._draining = drain
+            self._condition.notify_all()
+        self._dispatch_thread.join(timeout)
+
+    def dispatcher(self):
+        """Thread function, handing queued data to the handler."""
+        while True:
+            with self._condition:
+                while self._dispatch_alive and not self._items and \
+                        not self._spilled:
+                    self._condition.wait()
+                if not self._dispatch_alive and not (
+                        self._draining and (self._items or self._spilled)):
+                    break
+                if not self._items:
+                    self._unspill()
+                data = self._items.popleft()
+                self._condition.notify_all()
+
+            try:
+                self._handler(data)
+            except Exception:
+                logging.exception('Receive queue handler failed')
+
+        if self._stopped_handler is not None:
+            try:
+                self._stopped_handler()
+            except Exception:
+                logging.exception('Receive queue stopped handler failed')
+
+    def _overflow(self, data):
+        """Apply the policy to data arriving at a full queue.
+
+        Returns:
+          True if data is to be queued in memory.
+        """
+        if self._policy == POLICY_SPILL:
+            if len(self._items) >= self._maxsize:
+                self._overflows += 1
+            self._spill(data)
+            return False
+
+        self._overflows += 1
+        if self._policy == POLICY_BLOCK:
+            while len(self._items) >= self._maxsize and self._dispatch_alive:
+                self._condition.wait()
+            return True
+        if self._policy == POLICY_DROP_OLDEST:
+            self._drop(self._items.popleft())
+            return True
+        self._drop(data)
+        return False
+
+    def _drop(self, data):
+        """Count dropped data."""
+        self._dropped_items += 1
+        if isinstance(data, TaggedFrame):
+            data = data.payload
+        self._dropped_bytes += len(data)
+
+    def _spill(self, data):
+        """Append data to the spill file."""
+        if self._spill_file is None:
+            if self._spill_path:
+                self._spill_file = open(self._spill_path, 'w+b')
+            else:
+                self._spill_file = tempfile.TemporaryFile()
+        if isinstance(data, TaggedFrame):
+            kind = _KIND_VALID if data.valid else _KIND_INVALID
+            data = data.payload
+        elif isinstance(data, str):
+            kind = _KIND_STR
+            data = bytes(data, 'utf-8')
+        else:
+            kind = _KIND_BYTES
+
+        self._spill_file.seek(0, os.SEEK_END)
+        self._spill_file.write(_RECORD.pack(kind, len(data)))
+        self._spill_file.write(data)
+        self._spilled += 1
+        self._spilled_total += 1
+
+    def _unspill(self):
+        """Move up to maxsize spilled items back to memory, in order."""
+        self._spill_file.seek(self._spill_read)
+        while self._spilled and len(self._items) < self._maxsize:
+            kind, length = _RECORD.unpack(self._spill_file.read(_RECORD.size))
+            data = self._spill_file.read(length)
+            if kind == _KIND_STR:
+                data = str(data, 'utf-8')
+            elif kind != _KIND_BYTES:
+                data = TaggedFrame(data, kind == _KIND_VALID)
+            self._items.append(data)
+            self._spilled -= 1
+
+        self._spill_read = self._spill_file.tell()
+        if not self._spilled:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+            self._spill_read = 0
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a capture recorder module.
+
+This module has a class used to record every byte a Serial reads and writes
+to disk at full line rate. The read thread only packs a record and queues
+it; a record thread copies the records into preallocated, memory-mapped
+segment files.
+
+A capture is a directory of segments named <prefix>-<time>-<number>.seg.
+Each segment starts with SEGMENT_HEADER, then records of RECORD_HEADER
+(wall clock time, direction, length) followed by the data. A segment is
+truncated to its used size when closed; after a crash the unused end is
+zeros, and a record with a zero time marks the end. Beside each segment an
+.idx file holds INDEX_ENTRY (time, offset) pairs, one every index_interval
+bytes, for seeking.
+
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+
+from db_com.communications.receive_queue import ReceiveQueue, \
+    POLICY_DROP_NEWEST
+
+MAGIC = b'DBCAPSEG'
+SEGMENT_HEADER = struct.Struct('<8sd')
+RECORD_HEADER = struct.Struct('<dBI')
+INDEX_ENTRY = struct.Struct('<dQ')
+DIRECTION_RX, DIRECTION_TX = 0, 1
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+INDEX_INTERVAL = 64 * 1024
+
+
+class Recorder(object):
+    """Class records Serial traffic to memory-mapped segment files.
+
+    Set an instance as Serial.recorder while it is started.
+    """
+
+    def __init__(self, directory, prefix='capture', segment_size=SEGMENT_SIZE,
+                 index_interval=INDEX_INTERVAL, maxsize=65536):
+        """Configure the recorder initial values.
+
+        Args:
+          directory: The directory of the segment files, created if missing.
+          prefix: The prefix of the segment file names.
+          segment_size: The size segments are preallocated to and rotated
+            at.
+          index_interval: The bytes between two index entries.
+          maxsize: The most records waiting for the record thread.  Later
+            records are dropped and counted rather than blocking the reader.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._directory = directory
+        self._prefix = prefix
+        self._segment_size = segment_size
+        self._index_interval = index_interval
+        self._maxsize = maxsize
+        self._recording = False
+        self._new_capture(None)
+
+    @property
+    def recording(self):
+        """A property indicating whether the recorder is started."""
+        return self._recording
+
+    @property
+    def segments(self):
+        """A property containing the list of segment paths written."""
+        return self._capture.segments
+
+    def metrics(self):
+        """Return dict of records written and the queue counters."""
+        metrics = self._queue.metrics()
+        metrics.update({'records': self._capture.records,
+                        'bytes': self._capture.bytes,
+                        'segments': len(self._capture.segments)})
+        return metrics
+
+    def start(self):
+        """Start a new capture.
+
+        The capture has its own record thread, so a previous capture still
+        being written finishes in the background without delaying it.
+        """
+        if self._recording:
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        # Milliseconds, so a capture restarted at once gets its own files.
+        now = time.time()
+        self._new_capture('{}-{}.{:03d}'.format(
+            self._prefix, time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+            int(now % 1 * 1000)))
+        self._queue.start()
+        self._recording = True
+        logging.debug('Recording to {}'.format(self._directory))
+
+    def stop(self, wait=False):
+        """Stop recording, the record thread writes the queued records and
+        closes the capture.
+
+        Args:
+          wait: Whether to wait for the capture to be closed, e.g. before
+            reading it back.  The user interface does not wait.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if not self._recording:
+            return
+        self._recording = False
+        self._queue.stop(timeout=None if wait else 0, drain=True)
+
+    def record(self, data, direction=DIRECTION_RX):
+        """Queue data read or written, called from the Serial threads.
+
+        Args:
+          data: The bytes or memoryview transferred.
+          direction: DIRECTION_RX or DIRECTION_TX.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if self._recording:
+            self._queue.put(RECORD_HEADER.pack(time.time(), direction,
+                                               len(data)) + data)
+
+    def _new_capture(self, name):
+        """Replace the capture and its queue, the previous ones are left to
+        their record thread."""
+        self._capture = _Capture(self._directory, name, self._segment_size,
+                                 self._index_interval)
+        self._queue = ReceiveQueue(self._capture.write, self._maxsize,
+                                   POLICY_DROP_NEWEST,
+                                   stopped_handler=self._capture.close)
+
+
+class _Capture(object):
+    """Class writes the records of one capture into its segments, from the
+    record thread only."""
+
+    def __init__(self, directory, name, segment_size, index_interval):
+        self._directory = directory
+        self._name = name
+        self._segment_size = segment_size
+        self._index_interval = index_interval
+        self._number = 0
+        self._file = None
+        self._map = None
+        self._index = None
+        self._offset = 0
+        self._indexed = 0
+        self.segments = []
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, record):
+        """Record thread handler, copy one record into the segment."""
+        if self._map is None or self._offset + len(record) > len(self._map):
+            self._open_segment(len(record))
+
+        if self._offset - self._indexed >= self._index_interval or \
+                self._indexed == 0:
+            self._index.write(INDEX_ENTRY.pack(
+                RECORD_HEADER.unpack_from(record)[0], self._offset))
+            self._indexed = self._offset
+
+        end = self._offset + len(record)
+        self._map[self._offset:end] = record
+        self._offset = end
+        self.records += 1
+        self.bytes += len(record) - RECORD_HEADER.size
+
+    def close(self):
+        """Flush the current segment and truncate it to its used size."""
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(self._offset)
+        self._file.close()
+        self._index.close()
+        self._map = self._file = self._index = None
+
+    def _open_segment(self, size):
+        """Close the current segment and preallocate the next one, large
+        enough for a record of size."""
+        self.close()
+        self._number += 1
+        path = os.path.join(self._directory, '{}-{:04d}.seg'.format(
+            self._name, self._number))
+        size = max(self._segment_size, SEGMENT_HEADER.size + size)
+
+        self._file = open(path, 'w+b')
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._map[:SEGMENT_HEADER.size] = SEGMENT_HEADER.pack(MAGIC,
+                                                              time.time())
+        self._index = open(path[:-len('.seg')] + '.idx', 'wb')
+        self._offset = SEGMENT_HEADER.size
+        self._indexed = 0
+        self.segments.append(path)
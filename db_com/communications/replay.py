@@ -0,0 +1,275 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a capture replay module.
+
+This module has classes used to play captures written by Recorder back, at
+their original timing or N times faster, into a VirtualDevice pty or
+straight into a Serial read handler. Segments are read through mmap one
+record at a time, so memory stays bounded whatever the capture size.
+
+  $ python -m db_com.communications.replay ~/db_com_captures --speed 10
+
+"""
+
+import argparse
+import bisect
+import glob
+import logging
+import mmap
+import os
+import threading
+import time
+
+from db_com.communications.recorder import MAGIC, SEGMENT_HEADER, \
+    RECORD_HEADER, INDEX_ENTRY, DIRECTION_RX
+
+
+class CaptureReader(object):
+    """Class reads the records of a capture."""
+
+    def __init__(self, path, name=None):
+        """Find the segments of a capture.
+
+        Args:
+          path: A capture directory or a segment file.
+          name: The capture name, <prefix>-<time>, default the latest
+            capture in the directory.
+        Returns:
+          None
+        Raises:
+          ValueError: No capture is found.
+        """
+        if os.path.isfile(path):
+            segments = [path]
+        else:
+            segments = sorted(glob.glob(os.path.join(path, '*.seg')))
+            if name is None and segments:
+                name = os.path.basename(segments[-1]).rsplit('-', 1)[0]
+            segments = [segment for segment in segments
+                        if os.path.basename(segment).rsplit('-', 1)[0] == name]
+        if not segments:
+            raise ValueError('No capture found in {}.'.format(path))
+
+        self._segments = segments
+        self._indexes = [self._load_index(segment) for segment in segments]
+
+    @property
+    def segments(self):
+        """A property containing the list of segment paths."""
+        return self._segments
+
+    @staticmethod
+    def _load_index(segment):
+        """Return the (times, offsets) lists of the index of a segment."""
+        times, offsets = [], []
+        try:
+            with open(segment[:-len('.seg')] + '.idx', 'rb') as index:
+                data = index.read()
+        except OSError:
+            data = b''
+        for entry in INDEX_ENTRY.iter_unpack(
+                data[:len(data) // INDEX_ENTRY.size * INDEX_ENTRY.size]):
+            times.append(entry[0])
+            offsets.append(entry[1])
+
+        return times, offsets
+
+    def start_time(self):
+        """Return the time of the first record, or None if empty."""
+        for timestamp, _, _ in self.records():
+            return timestamp
+        return None
+
+    def records(self, start_time=None):
+        """Generate the records of the capture.
+
+        Args:
+          start_time: The time to seek to through the index, default the
+            beginning.
+        Returns:
+          A generator of (time, direction, bytes) tuples.
+        """
+        first = 0
+        if start_time is not None:
+            starts = [times[0] if times else float('-inf')
+                      for times, _ in self._indexes]
+            first = max(0, bisect.bisect_right(starts, start_time) - 1)
+
+        for number in range(first, len(self._segments)):
+            offset = SEGMENT_HEADER.size
+            times, offsets = self._indexes[number]
+            if start_time is not None and times:
+                entry = bisect.bisect_right(times, start_time) - 1
+                if entry >= 0:
+                    offset = offsets[entry]
+            for record in self._segment_records(self._segments[number],
+                                                offset):
+                if start_time is None or record[0] >= start_time:
+                    yield record
+
+    @staticmethod
+    def _segment_records(segment, offset):
+        """Generate the records of one segment from offset."""
+        with open(segment, 'rb') as segment_file:
+            size = os.fstat(segment_file.fileno()).st_size
+            if size < SEGMENT_HEADER.size:
+                return
+            with mmap.mmap(segment_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as data:
+                if SEGMENT_HEADER.unpack_from(data)[0] != MAGIC:
+                    raise ValueError('{} is not a segment.'.format(segment))
+                while offset + RECORD_HEADER.size <= size:
+                    timestamp, direction, length = \
+                        RECORD_HEADER.unpack_from(data, offset)
+                    # Unused space left by a crash.
+                    if timestamp == 0:
+                        return
+                    offset += RECORD_HEADER.size
+                    yield timestamp, direction, data[offset:offset + length]
+                    offset += length
+
+
+class Replayer(object):
+    """Class plays a capture back in real time or faster."""
+
+    def __init__(self, reader, target, speed=1.0, direction=DIRECTION_RX):
+        """Configure the replay.
+
+        Args:
+          reader: The CaptureReader of the capture.
+          target: A VirtualDevice, whose port Serial opens, or a Serial,
+            whose read handler gets the data through feed without a port.
+          speed: The speed factor, e.g. 10 for ten times faster, or None
+            for as fast as possible.
+          direction: The direction of the records replayed, default what
+            was read from the device.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._reader = reader
+        self._send = target.send if hasattr(target, 'send') else target.feed
+        self._speed = speed
+        self._direction = direction
+        self._alive = False
+        self._thread = None
+        self._report = {}
+
+    @property
+    def report(self):
+        """A property containing the dict reported by the last run."""
+        return self._report
+
+    def run(self, start_time=None):
+        """Replay the capture from start_time until its end or stop.
+
+        Args:
+          start_time: The capture time to start from, default the
+            beginning.
+        Returns:
+          dict of the requested and achieved duration and byte rates, and
+            the largest lag behind the schedule.
+        Raises:
+          None
+        """
+        self._alive = True
+        first = last = None
+        records = total = 0
+        max_lag = 0
+        start = time.monotonic()
+        for timestamp, direction, data in self._reader.records(start_time):
+            if not self._alive:
+                break
+            if direction != self._direction:
+                continue
+            if first is None:
+                first = timestamp
+            last = timestamp
+            if self._speed:
+                lag = time.monotonic() - start - \
+                    (timestamp - first) / self._speed
+                if lag < 0:
+                    time.sleep(-lag)
+                else:
+                    max_lag = max(max_lag, lag)
+            self._send(data)
+            records += 1
+            total += len(data)
+
+        elapsed = time.monotonic() - start
+        duration = 0 if first is None else last - first
+        requested = duration / self._speed if self._speed else 0
+        self._report = {
+            'records': records, 'bytes': total,
+            'capture_seconds': duration,
+            'requested_seconds': requested,
+            'achieved_seconds': elapsed,
+            'requested_bytes_per_second': total / requested if requested
+            else None,
+            'achieved_bytes_per_second': total / elapsed if elapsed else None,
+            'achieved_speed': duration / elapsed if elapsed else None,
+            'max_lag': max_lag,
+        }
+        self._alive = False
+
+        return self._report
+
+    def start(self, start_time=None):
+        """Start replay thread."""
+        self._thread = threading.Thread(target=self.run, args=(start_time,),
+                                        name='Replay')
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self._thread
+
+    def stop(self):
+        """Stop replay thread."""
+        self._alive = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main(argv=None):
+    from db_com.communications.virtual_device import VirtualDevice
+
+    parser = argparse.ArgumentParser(description='Replay a capture into a '
+                                                 'virtual serial port.')
+    parser.add_argument('path', help='capture directory or segment file')
+    parser.add_argument('--name', help='capture name, default the latest')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='speed factor, 0 for as fast as possible')
+    parser.add_argument('--start', type=float,
+                        help='seconds into the capture to start from')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    reader = CaptureReader(args.path, args.name)
+    start_time = None
+    if args.start:
+        start_time = reader.start_time() + args.start
+    with VirtualDevice() as device:
+        logging.info('Replaying on {}, press Enter to start'.format(
+            device.port))
+        input()
+        report = Replayer(reader, device, args.speed or None).run(start_time)
+    logging.info(report)
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,403 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a script engine module.
+
+This module has classes used to run expect-style scripts against many Serial
+ports at once, e.g. on a flashing station. A script is a JSON list of steps:
+
+  {"send": "AT+VER?"}
+  {"expect": {"VER=": null, "ERROR": "retry"}, "timeout": 5,
+   "capture": {"version": "VER=(\\\\S+)"}, "on_timeout": "retry"}
+  {"label": "retry"}, {"goto": "retry"}, {"sleep": 0.5}
+  {"pass": "flashed {version}"}, {"fail": "no answer"}
+
+send, pass and fail texts are formatted with the variables of the port,
+which start from the ones given to the engine and gain the captures. expect
+waits for the first of its patterns, then goes on, or to the label mapped to
+that pattern. Captures are searched in the response up to the end of the
+line the pattern is in. Without on_timeout a timeout fails the script. Each
+port runs in its own thread of a pool, as Serial reads block in select and
+release the GIL, so a station takes about as long for many ports as for
+one.
+
+  $ python -m db_com.communications.script_engine flash.json \\
+        /dev/ttyUSB0 /dev/ttyUSB1 --baudrate 115200
+
+"""
+
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+STEP_KINDS = ('send', 'expect', 'sleep', 'label', 'goto', 'pass', 'fail')
+STEP_OPTIONS = {'send': ('wait_between_characters',),
+                'expect': ('timeout', 'capture', 'on_timeout')}
+MAX_STEPS = 100000
+PASSED, FAILED, ABORTED = 'passed', 'failed', 'aborted'
+
+ScriptResult = namedtuple('ScriptResult',
+                          'port status message variables seconds steps')
+
+
+class Script(object):
+    """Class holds a validated script."""
+
+    def __init__(self, steps, name='script', timeout=10):
+        """Configure the script and check its steps.
+
+        Args:
+          steps: The list of step dicts, see the module.
+          name: The name of the script in reports.
+          timeout: The seconds an expect waits without its own timeout.
+        Returns:
+          None
+        Raises:
+          ValueError: A step is invalid or names an unknown label.
+        """
+        self._name = name
+        self._timeout = timeout
+        self._steps = []
+        self._labels = {}
+        for index, step in enumerate(steps):
+            kinds = [kind for kind in STEP_KINDS if kind in step]
+            if len(kinds) != 1:
+                raise ValueError('Step {} needs one of {}.'.format(
+                    index, ', '.join(STEP_KINDS)))
+            kind = kinds[0]
+            unknown = set(step) - {kind} - set(STEP_OPTIONS.get(kind, ()))
+            if unknown:
+                raise ValueError('Step {} has unknown keys {}.'.format(
+                    index, ', '.join(sorted(unknown))))
+            if kind == 'label':
+                if step['label'] in self._labels:
+                    raise ValueError('Step {} repeats label {}.'.format(
+                        index, step['label']))
+                self._labels[step['label']] = index
+            self._steps.append(self._compile(index, kind, step))
+
+        for index, (kind, step) in enumerate(self._steps):
+            targets = [step.get('on_timeout'), step.get('goto')]
+            if kind == 'expect':
+                targets.extend(step['expect'].values())
+            for target in targets:
+                if target is not None and target not in self._labels:
+                    raise ValueError('Step {} goes to unknown label {}.'.format(
+                        index, target))
+
+    @staticmethod
+    def _compile(index, kind, step):
+        """Return (kind, step) with the expect patterns as a dict of pattern
+        to label and the captures compiled."""
+        step = dict(step)
+        if kind == 'expect':
+            patterns = step['expect']
+            if isinstance(patterns, str):
+                patterns = [patterns]
+            if not isinstance(patterns, dict):
+                patterns = dict.fromkeys(patterns)
+            if not patterns or not all(patterns):
+                raise ValueError('Step {} expects an empty pattern.'.format(
+                    index))
+            step['expect'] = patterns
+            try:
+                step['capture'] = {name: re.compile(expression)
+                                   for name, expression in
+                                   step.get('capture', {}).items()}
+            except re.error as error:
+                raise ValueError('Step {} capture : {}'.format(index, error))
+        elif kind == 'sleep' and not isinstance(step['sleep'], (int, float)):
+            raise ValueError('Step {} sleeps for a non-number.'.format(index))
+
+        return kind, step
+
+    @classmethod
+    def load(cls, path):
+        """Return the Script of a JSON file, either a list of steps or an
+        object with steps and optional name and timeout."""
+        with open(path) as script_file:
+            content = json.load(script_file)
+        if isinstance(content, list):
+            content = {'steps': content}
+        return cls(content['steps'], content.get('name', path),
+                   content.get('timeout', 10))
+
+    @property
+    def name(self):
+        """A property indicating the name of the script."""
+        return self._name
+
+    @property
+    def timeout(self):
+        """A property indicating the default expect timeout."""
+        return self._timeout
+
+    @property
+    def steps(self):
+        """A property containing the list of (kind, step)."""
+        return self._steps
+
+    @property
+    def labels(self):
+        """A property containing the dict of label to step index."""
+        return self._labels
+
+    @staticmethod
+    def describe(kind, step):
+        """Return a short text of a step for progress reports."""
+        if kind == 'expect':
+            return 'expect {}'.format(' | '.join(step['expect']))
+        return '{} {}'.format(kind, step[kind])
+
+
+class ScriptEngine(object):
+    """Class runs a Script against many Serial ports concurrently."""
+
+    def __init__(self, script, progress_handler=None, done_handler=None,
+                 max_workers=None):
+        """Configure the engine initial values.
+
+        Args:
+          script: The Script to run.
+          progress_handler: The handler called from the port threads before
+            each step, with the port, the step index, the step count and a
+            description of the step.
+          done_handler: The handler called from the port threads with the
+            ScriptResult of each port.
+          max_workers: The most ports run at once, default all of them.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._script = script
+        self._progress_handler = progress_handler
+        self._done_handler = done_handler
+        self._max_workers = max_workers
+        self._stopping = threading.Event()
+
+    @property
+    def script(self):
+        """A property containing the Script run."""
+        return self._script
+
+    def stop(self):
+        """Abort the scripts running, from any thread."""
+        self._stopping.set()
+
+    def run(self, serial_ports, variables=None):
+        """Run the script on every port and wait for all of them.
+
+        Args:
+          serial_ports: The list of Serial without read handler.  Ports not
+            open are opened, and closed again at the end.
+          variables: The dict of port name to dict of starting variables,
+            e.g. serial numbers.
+        Returns:
+          dict summary of ports, passed, failed, aborted, seconds, the
+            seconds the ports would take one after the other, and the list
+            of ScriptResult.
+        Raises:
+          None
+        """
+        self._stopping.clear()
+        variables = variables or {}
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self._max_workers or
+                                max(1, len(serial_ports)),
+                                thread_name_prefix='Script') as executor:
+            futures = [executor.submit(self._run_opened, serial_port,
+                                       variables.get(serial_port.port))
+                       for serial_port in serial_ports]
+            results = [future.result() for future in futures]
+
+        summary = {'script': self._script.name, 'ports': len(results),
+                   'seconds': time.monotonic() - start,
+                   'sequential_seconds': sum(result.seconds
+                                             for result in results),
+                   'results': results}
+        for status in (PASSED, FAILED, ABORTED):
+            summary[status] = sum(result.status == status
+                                  for result in results)
+
+        return summary
+
+    def _run_opened(self, serial_port, variables):
+        """Open the port if needed, run the script and report the result."""
+        opened = serial_port.session is None
+        try:
+            if opened:
+                serial_port.open()
+            result = self.run_port(serial_port, variables)
+        except Exception as error:
+            logging.error('{} : {}'.format(serial_port.port, error))
+            result = ScriptResult(serial_port.port, FAILED, str(error),
+                                  dict(variables or {}), 0.0, 0)
+        finally:
+            if opened:
+                serial_port.close()
+        if self._done_handler is not None:
+            self._done_handler(result)
+
+        return result
+
+    def run_port(self, serial_port, variables=None):
+        """Run the script on one open port.
+
+        Args:
+          serial_port: The open Serial without read handler.
+          variables: The dict of starting variables.
+        Returns:
+          ScriptResult of the port.
+        Raises:
+          KeyError: A text names a variable that is not set.
+          serial.SerialException: The port failed.
+        """
+        port = serial_port.port
+        variables = dict(variables or {})
+        steps, labels = self._script.steps, self._script.labels
+        start = time.monotonic()
+        index = executed = 0
+
+        def result(status, message=''):
+            logging.debug('{} {} : {}'.format(port, status, message))
+            return ScriptResult(port, status, message, variables,
+                                time.monotonic() - start, executed)
+
+        while index < len(steps):
+            if self._stopping.is_set():
+                return result(ABORTED, 'stopped')
+            if executed >= MAX_STEPS:
+                return result(FAILED, 'more than {} steps'.format(MAX_STEPS))
+            executed += 1
+            kind, step = steps[index]
+            if self._progress_handler is not None:
+                self._progress_handler(port, index, len(steps),
+                                       Script.describe(kind, step))
+
+            if kind == 'send':
+                serial_port.write(
+                    step['send'].format_map(variables),
+                    wait_between_characters=step.get(
+                        'wait_between_characters'))
+            elif kind == 'expect':
+                patterns = {pattern.format_map(variables): target
+                            for pattern, target in step['expect'].items()}
+                timeout = step.get('timeout', self._script.timeout)
+                deadline = time.monotonic() + timeout
+                response = serial_port.read_untils(
+                    list(patterns), timeout=timeout,
+                    force_abort=self._stopping.is_set)
+                match = self._first_match(response, patterns)
+                if match is None:
+                    if self._stopping.is_set():
+                        return result(ABORTED, 'stopped')
+                    if step.get('on_timeout') is None:
+                        return result(FAILED, 'timeout at {}'.format(
+                            Script.describe(kind, step)))
+                    index = labels[step['on_timeout']]
+                    continue
+                if step['capture']:
+                    response += self._rest_of_line(serial_port, response,
+                                                   deadline)
+                for name, expression in step['capture'].items():
+                    found = expression.search(response)
+                    if found is None:
+                        return result(FAILED, 'no {} in {!r}'.format(
+                            name, response))
+                    variables[name] = found.group(1 if expression.groups
+                                                  else 0)
+                if patterns[match] is not None:
+                    index = labels[patterns[match]]
+                    continue
+            elif kind == 'sleep':
+                if self._stopping.wait(step['sleep']):
+                    return result(ABORTED, 'stopped')
+            elif kind == 'goto':
+                index = labels[step['goto']]
+                continue
+            elif kind in ('pass', 'fail'):
+                return result(PASSED if kind == 'pass' else FAILED,
+                              str(step[kind]).format_map(variables))
+            index += 1
+
+        return result(PASSED)
+
+    def _rest_of_line(self, serial_port, response, deadline):
+        """Return the rest of the line the pattern matched in, which
+        read_untils leaves unread when it has not arrived yet."""
+        end = serial_port.read_terminal_character[-1:]
+        if response.endswith(end):
+            return ''
+        return serial_port.read_until(
+            end, timeout=max(0, deadline - time.monotonic()),
+            force_abort=self._stopping.is_set)
+
+    @staticmethod
+    def _first_match(response, patterns):
+        """Return the pattern that completed first in response, or None."""
+        ends = [(response.find(pattern) + len(pattern), pattern)
+                for pattern in patterns if pattern in response]
+
+        return min(ends)[1] if ends else None
+
+
+def main(argv=None):
+    from db_com.communications.db_serial import Serial
+
+    parser = argparse.ArgumentParser(description='Run an expect script on '
+                                                 'serial ports concurrently.')
+    parser.add_argument('script', help='JSON script file')
+    parser.add_argument('ports', nargs='+', help='serial ports')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--workers', type=int,
+                        help='most ports run at once, default all')
+    parser.add_argument('--variables',
+                        help='JSON file of port to starting variables')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    variables = None
+    if args.variables:
+        with open(args.variables) as variables_file:
+            variables = json.load(variables_file)
+
+    def progress(port, index, count, description):
+        logging.info('{} [{}/{}] {}'.format(port, index + 1, count,
+                                            description))
+
+    def done(result):
+        logging.info('{} {} {} ({:.1f} s)'.format(
+            result.port, result.status.upper(), result.message,
+            result.seconds))
+
+    engine = ScriptEngine(Script.load(args.script), progress, done,
+                          args.workers)
+    summary = engine.run([Serial(port, args.baudrate) for port in args.ports],
+                         variables)
+    logging.info('{passed}/{ports} passed, {failed} failed, {aborted} '
+                 'aborted in {seconds:.1f} s ({sequential_seconds:.1f} s '
+                 'one port at a time)'.format(**summary))
+
+    return 0 if summary['passed'] == summary['ports'] else 1
+
+
+if '__main__' == __name__:
+    raise SystemExit(main())
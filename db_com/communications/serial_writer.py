@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a serial writer module.
+
+This module has a class used to write to a Serial from its own thread, so
+the caller only queues commands and never blocks on serial I/O.
+
+"""
+
+import logging
+import queue
+import threading
+import time
+
+
+class SerialWriter(object):
+    """Class writes queued commands to a Serial from a writer thread."""
+
+    def __init__(self, serial_port, done_handler=None, maxsize=0):
+        """Configure the writer initial values.
+
+        Args:
+          serial_port: The Serial to write to.
+          done_handler: The handler called from the writer thread after each
+            write, with the command, the latency in seconds from queueing to
+            completion, and the exception or None.
+          maxsize: The most commands queued, 0 for no limit.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._serial = serial_port
+        self._done_handler = done_handler
+        self._maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._writer_thread = None
+        self._writer_alive = False
+        self._written = 0
+        self._failed = 0
+        self._last_latency = 0.0
+        self._max_latency = 0.0
+        self._total_latency = 0.0
+
+    @property
+    def queue_depth(self):
+        """A property indicating the number of commands waiting."""
+        return self._queue.qsize()
+
+    @property
+    def alive(self):
+        """A property indicating whether the writer thread runs."""
+        return self._writer_alive
+
+    def metrics(self):
+        """Return dict of queue depth and write latency in seconds."""
+        written = self._written
+        mean = self._total_latency / written if written else 0.0
+        return {'queue_depth': self._queue.qsize(), 'written': written,
+                'failed': self._failed, 'last_latency': self._last_latency,
+                'max_latency': self._max_latency, 'mean_latency': mean}
+
+    def send(self, command, **kwargs):
+        """Queue a command without waiting for it to be written.
+
+        Args:
+          command: The string command to be written.
+          kwargs: The keyword arguments of Serial.write.
+        Returns:
+          None
+        Raises:
+          queue.Full: maxsize commands are already waiting.
+        """
+        self._queue.put_nowait((command, kwargs, time.monotonic()))
+
+    def start(self):
+        """Start writer thread."""
+        if self._writer_alive:
+            return
+        self._writer_alive = True
+        # A stopped thread may still be finishing a write, give the new one
+        # its own queue so they never share commands.
+        self._queue = queue.Queue(self._maxsize)
+        self._writer_thread = threading.Thread(target=self.writer,
+                                               args=(self._queue,),
+                                               name='Serial_Tx')
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def stop(self, timeout=None):
+        """Stop writer thread and drop the commands still waiting.
+
+        Args:
+          timeout: The most seconds to wait for the thread, default until it
+            exits.  A write in progress is not interrupted.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if not self._writer_alive:
+            return
+        self._writer_alive = False
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._queue.put(None)
+        self._writer_thread.join(timeout)
+
+    def writer(self, commands):
+        """Thread function, writing queued commands to the serial port.
+
+        Args:
+          commands: The queue of the thread.
+        """
+        while True:
+            item = commands.get()
+            if item is None:
+                break
+            command, kwargs, queued_time = item
+
+            error = None
+            try:
+                self._serial.write(command, **kwargs)
+            except Exception as write_error:
+                error = write_error
+                self._failed += 1
+                logging.error('write {} failed : {}'.format(command, error))
+
+            latency = time.monotonic() - queued_time
+            if error is None:
+                self._written += 1
+                self._last_latency = latency
+                self._total_latency += latency
+                if latency > self._max_latency:
+                    self._max_latency = latency
+            if self._done_handler:
+                self._done_handler(command, latency, error)
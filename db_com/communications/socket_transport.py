@@ -0,0 +1,510 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a socket transport module.
+
+This module has classes used to talk to devices behind terminal servers, and
+to share one serial port between processes. SocketSerial is a Serial over a
+TCP or Unix socket, so it has the same read, query and read_until behaviour.
+Its connections come from a ConnectionPool, which keeps them alive with TCP
+keep-alive and hands a closed SocketSerial's connection to the next one
+opened on the same address. SerialServer exposes a local Serial to many
+clients, sending what the port reads to every client and writing what any
+client sends.
+
+Addresses are 'host:port' or 'tcp://host:port' for TCP, and '/path' or
+'unix:///path' for Unix sockets.
+
+  $ python -m db_com.communications.socket_transport /dev/ttyUSB0 \\
+        --baudrate 115200 --address 127.0.0.1:7000
+
+"""
+
+import argparse
+import fcntl
+import logging
+import os
+import select
+import socket
+import struct
+import termios
+import threading
+import time
+from collections import defaultdict
+
+import serial
+
+from db_com.communications.broadcast_hub import BroadcastHub
+from db_com.communications.db_serial import Serial
+from db_com.communications.framers import RawFramer
+
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+
+def parse_address(address):
+    """Return (family, socket address) of an address, see the module.
+
+    Raises:
+      ValueError: The address has no port or path.
+    """
+    if address.startswith('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+    if address.startswith('tcp://'):
+        address = address[len('tcp://'):]
+    elif address.startswith('/'):
+        return socket.AF_UNIX, address
+
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError('Address {} needs host:port or a path.'.format(
+            address))
+    return socket.AF_INET, (host.strip('[]'), int(port))
+
+
+def format_address(family, address):
+    """Return the address text of a socket address."""
+    if family == socket.AF_UNIX:
+        return address
+    return '{}:{}'.format(*address[:2])
+
+
+def _keep_alive(connection):
+    """Enable TCP keep-alive, with the timing where the OS allows."""
+    connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+                          ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            connection.setsockopt(socket.IPPROTO_TCP,
+                                  getattr(socket, option), value)
+
+
+class ConnectionPool(object):
+    """Class keeps idle socket connections for reuse, per address."""
+
+    def __init__(self, max_idle=4, idle_timeout=300, connect_timeout=5):
+        """Configure the pool initial values.
+
+        Args:
+          max_idle: The most idle connections kept per address.
+          idle_timeout: The seconds an idle connection is kept.
+          connect_timeout: The seconds a new connection may take.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._max_idle = max_idle
+        self._idle_timeout = idle_timeout
+        self._connect_timeout = connect_timeout
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+
+    def metrics(self):
+        """Return dict of connections created, reused and idle."""
+        with self._lock:
+            idle = sum(len(connections) for connections in
+                       self._idle.values())
+        return {'created': self._created, 'reused': self._reused,
+                'idle': idle}
+
+    def acquire(self, address):
+        """Return a connected socket, an idle one if any is still alive.
+
+        Data the device sent while the connection was idle is dropped.
+
+        Args:
+          address: The address to connect to.
+        Returns:
+          The connected socket.
+        Raises:
+          OSError: The connection failed.
+        """
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle[address]:
+                    break
+                connection, idle_time = self._idle[address].pop()
+            if now - idle_time < self._idle_timeout and \
+                    self._drain(connection):
+                self._reused += 1
+                return connection
+            connection.close()
+
+        family, socket_address = parse_address(address)
+        connection = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            connection.settimeout(self._connect_timeout)
+            connection.connect(socket_address)
+        except OSError:
+            connection.close()
+            raise
+        if family != socket.AF_UNIX:
+            _keep_alive(connection)
+        self._created += 1
+
+        return connection
+
+    def release(self, address, connection):
+        """Give a connection back for reuse, or close it when the pool is
+        full.
+
+        Args:
+          address: The address the connection was acquired for.
+          connection: The socket.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        with self._lock:
+            idle = self._idle[address]
+            if len(idle) < self._max_idle:
+                idle.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def close_all(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+    @staticmethod
+    def _drain(connection):
+        """Read and drop pending data, return False if the peer closed."""
+        try:
+            while select.select([connection], [], [], 0)[0]:
+                if not connection.recv(65536):
+                    return False
+        except OSError:
+            return False
+        return True
+
+
+DEFAULT_POOL = ConnectionPool()
+
+
+class SocketSession(object):
+    """Class gives a pooled socket the part of the pyserial interface
+    Serial uses."""
+
+    def __init__(self, address, pool):
+        self.port = address
+        self.timeout = None
+        self.writeTimeout = None
+        self._pool = pool
+        self._socket = None
+        self._broken = False
+
+    def open(self):
+        """Acquire a connection from the pool.
+
+        Raises:
+          serial.SerialException: The connection failed.
+        """
+        try:
+            self._socket = self._pool.acquire(self.port)
+        except OSError as error:
+            raise serial.SerialException('Could not connect to {} : {}'.format(
+                self.port, error))
+        self._broken = False
+
+    def isOpen(self):
+        return self._socket is not None
+
+    def close(self):
+        """Give the connection back to the pool, or close it if it failed."""
+        if self._socket is None:
+            return
+        if self._broken:
+            self._socket.close()
+        else:
+            self._pool.release(self.port, self._socket)
+        self._socket = None
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    @property
+    def in_waiting(self):
+        """The number of bytes received and not read yet."""
+        count = fcntl.ioctl(self._socket.fileno(), termios.FIONREAD,
+                            b'\x00' * 4)
+        return struct.unpack('i', count)[0]
+
+    def readinto(self, buffer):
+        """Read into a buffer, waiting up to timeout for data.
+
+        Raises:
+          serial.SerialException: The peer closed the connection.
+        """
+        try:
+            self._socket.settimeout(self.timeout)
+            count = self._socket.recv_into(buffer)
+        except socket.timeout:
+            return 0
+        except OSError as error:
+            self._broken = True
+            raise serial.SerialException(error)
+        if not count:
+            self._broken = True
+            raise serial.SerialException('Connection to {} closed.'.format(
+                self.port))
+        return count
+
+    def write(self, data):
+        """Send all data, waiting up to writeTimeout.
+
+        Raises:
+          serial.SerialTimeoutException: The data could not be sent in time.
+          serial.SerialException: The connection failed.
+        """
+        try:
+            self._socket.settimeout(self.writeTimeout)
+            self._socket.sendall(data)
+        except socket.timeout:
+            self._broken = True
+            raise serial.SerialTimeoutException('Write timeout')
+        except OSError as error:
+            self._broken = True
+            raise serial.SerialException(error)
+        return len(data)
+
+
+class SocketSerial(Serial):
+    """Class provides the Serial methods over a TCP or Unix socket."""
+
+    def __init__(self, address, pool=None, **kwargs):
+        """Configure the driver initial values.
+
+        Args:
+          address: The address of the terminal server or SerialServer, see
+            the module.
+          pool: The ConnectionPool, default DEFAULT_POOL.
+          kwargs: The keyword arguments of Serial, the line settings are
+            those of the remote port.
+        Returns:
+          None
+        Raises:
+          ValueError: The address is invalid, or see Serial.
+        """
+        parse_address(address)
+        super(SocketSerial, self).__init__(address, 0, **kwargs)
+        self._pool = pool or DEFAULT_POOL
+
+    @staticmethod
+    def list_ports():
+        """Sockets are not enumerated."""
+        return []
+
+    def _create_session(self):
+        """Create a socket session, not connected yet."""
+        return SocketSession(self.port, self._pool)
+
+
+class SerialServer(object):
+    """Class exposes a Serial port to many socket clients."""
+
+    def __init__(self, port, baudrate, address='127.0.0.1:0', max_clients=8,
+                 client_queue_size=10000, **kwargs):
+        """Configure the server initial values.
+
+        Args:
+          port: The serial port to share.
+          baudrate: The baudrate to use.
+          address: The address to listen on, see the module.  Port 0 picks
+            a free port, see address once started.
+          max_clients: The most clients connected at once.
+          client_queue_size: The most reads queued for a client.  A slow
+            client loses its oldest data instead of delaying the others.
+          kwargs: The other keyword arguments of Serial.
+        Returns:
+          None
+        Raises:
+          ValueError: The address is invalid.
+        """
+        self._family, self._socket_address = parse_address(address)
+        self._max_clients = max_clients
+        self._client_queue_size = client_queue_size
+        self._hub = BroadcastHub()
+        self._serial = Serial(port, baudrate, bytes_mode=True,
+                              framer=RawFramer(), read_handler=self._hub,
+                              **kwargs)
+        self._listener = None
+        self._wakeup = None
+        self._server_thread = None
+        self._server_alive = False
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @property
+    def serial(self):
+        """A property containing the shared Serial, e.g. for its
+        statistics."""
+        return self._serial
+
+    @property
+    def address(self):
+        """A property indicating the address listened on."""
+        if self._listener is not None:
+            return format_address(self._family,
+                                  self._listener.getsockname())
+        return format_address(self._family, self._socket_address)
+
+    def metrics(self):
+        """Return dict of clients connected and their queue metrics."""
+        return {'clients': len(self._clients),
+                'queues': self._hub.metrics()}
+
+    def start(self):
+        """Open the serial port and start listening."""
+        if self._server_alive:
+            return
+        if self._family == socket.AF_UNIX and \
+                os.path.exists(self._socket_address):
+            os.unlink(self._socket_address)
+        self._listener = socket.socket(self._family, socket.SOCK_STREAM)
+        if self._family != socket.AF_UNIX:
+            self._listener.setsockopt(socket.SOL_SOCKET,
+                                      socket.SO_REUSEADDR, 1)
+        self._listener.bind(self._socket_address)
+        self._listener.listen(self._max_clients)
+        self._serial.open()
+
+        self._server_alive = True
+        self._wakeup = os.pipe()
+        self._server_thread = threading.Thread(target=self.server,
+                                               name='SerialServer')
+        self._server_thread.daemon = True
+        self._server_thread.start()
+        logging.debug('Serving {} on {}'.format(self._serial.port,
+                                                self.address))
+
+    def stop(self):
+        """Disconnect the clients, stop listening and close the port."""
+        if not self._server_alive:
+            return
+        self._server_alive = False
+        os.write(self._wakeup[1], b'x')
+        self._server_thread.join()
+        with self._lock:
+            clients = list(self._clients.items())
+        for client, _ in clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for _, (_, thread) in clients:
+            thread.join()
+        self._serial.close()
+        self._listener.close()
+        self._listener = None
+        for fileno in self._wakeup:
+            os.close(fileno)
+        self._wakeup = None
+        if self._family == socket.AF_UNIX:
+            os.unlink(self._socket_address)
+
+    def server(self):
+        """Thread function, accepting clients."""
+        while self._server_alive:
+            readable, _, _ = select.select([self._listener, self._wakeup[0]],
+                                           [], [])
+            if self._listener not in readable:
+                continue
+            client, _ = self._listener.accept()
+            if len(self._clients) >= self._max_clients:
+                logging.warning('Too many clients of {}'.format(
+                    self._serial.port))
+                client.close()
+                continue
+            self._add_client(client)
+
+    def _add_client(self, client):
+        """Subscribe a client to the port reads and start its thread."""
+        if self._family != socket.AF_UNIX:
+            _keep_alive(client)
+
+        def send(data):
+            try:
+                client.sendall(data)
+            except OSError:
+                # The client thread sees the connection fail and cleans up.
+                pass
+
+        subscription = self._hub.subscribe(
+            send, maxsize=self._client_queue_size,
+            name='client {}'.format(client.fileno()))
+        thread = threading.Thread(target=self.client_reader,
+                                  args=(client, subscription),
+                                  name='SerialServer_Client')
+        thread.daemon = True
+        with self._lock:
+            self._clients[client] = (subscription, thread)
+        thread.start()
+
+    def client_reader(self, client, subscription):
+        """Thread function, writing what a client sends to the port."""
+        try:
+            while True:
+                data = client.recv(65536)
+                if not data:
+                    break
+                with self._write_lock:
+                    self._serial.session.write(data)
+        except (OSError, serial.SerialException) as error:
+            logging.debug('Client of {} failed : {}'.format(
+                self._serial.port, error))
+        finally:
+            self._hub.unsubscribe(subscription)
+            with self._lock:
+                self._clients.pop(client, None)
+            client.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Share a serial port over '
+                                                 'a socket.')
+    parser.add_argument('port', help='serial port')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--address', default='127.0.0.1:7000',
+                        help='host:port or Unix socket path to listen on')
+    parser.add_argument('--max-clients', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = SerialServer(args.port, args.baudrate, args.address,
+                          args.max_clients)
+    server.start()
+    logging.info('Serving {} on {}, press Enter to stop'.format(
+        args.port, server.address))
+    try:
+        input()
+    finally:
+        server.stop()
+
+
+if '__main__' == __name__:
+    main()
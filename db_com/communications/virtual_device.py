@@ -0,0 +1,235 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a virtual serial device module.
+
+This module has a class used to emulate a serial device behind a Linux
+pseudo-terminal pair, so Serial can be exercised and benchmarked without
+hardware. Serial opens VirtualDevice.port like any other port.
+
+"""
+
+import logging
+import os
+import pty
+import re
+import select
+import threading
+import time
+import tty
+
+
+class VirtualDevice(object):
+    """Class runs a scriptable fake firmware on the master side of a pty."""
+
+    def __init__(self, responses=None, echo=False, terminator=b'\r\n',
+                 response_delay=0, line_delay=0, prompt=None):
+        """Configure the device initial values.
+
+        Args:
+          responses: List of (pattern, response) pairs.  A received command
+            matching the regular expression pattern gets the response, which
+            is a str, a list of str lines, or a callable taking the command
+            and the match and returning either.
+          echo: The boolean echo of each received command.
+          terminator: The bytes ending each line sent.
+          response_delay: The time to wait before answering a command.
+          line_delay: The time to wait between lines of a response.
+          prompt: The str written without terminator after each response.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._responses = [(re.compile(pattern), response)
+                           for pattern, response in (responses or [])]
+        self._echo = echo
+        self._terminator = terminator
+        self._response_delay = response_delay
+        self._line_delay = line_delay
+        self._prompt = prompt
+        self._master = None
+        self._slave = None
+        self._port = None
+        self._wakeup = None
+        self._device_alive = False
+        self._device_thread = None
+        self._stream_threads = []
+        self._write_lock = threading.Lock()
+        self._received = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def port(self):
+        """A property indicating the port name to open with Serial."""
+        return self._port
+
+    @property
+    def received(self):
+        """A property containing the list of commands received."""
+        return self._received
+
+    def add_response(self, pattern, response):
+        """Add a (pattern, response) pair, see the constructor."""
+        self._responses.append((re.compile(pattern), response))
+
+    def open(self):
+        """Create the pty pair and start the firmware thread."""
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self._port = os.ttyname(self._slave)
+        self._wakeup = os.pipe()
+        self._device_alive = True
+        self._device_thread = threading.Thread(target=self.firmware,
+                                               name='VirtualDevice')
+        self._device_thread.daemon = True
+        self._device_thread.start()
+        logging.debug('Virtual device on {}'.format(self._port))
+
+    def close(self):
+        """Stop the firmware and stream threads and close the pty pair."""
+        if not self._device_alive:
+            return
+        self._device_alive = False
+        os.write(self._wakeup[1], b'x')
+        self._device_thread.join()
+        for thread in self._stream_threads:
+            thread.join()
+        self._stream_threads = []
+        for fileno in (self._master, self._slave) + self._wakeup:
+            os.close(fileno)
+        self._master = self._slave = self._wakeup = None
+
+    def send(self, data):
+        """Write data to the port as the device.
+
+        Args:
+          data: The str or bytes to write, sent as is.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if isinstance(data, str):
+            data = bytes(data, 'utf-8')
+        view = memoryview(data)
+        with self._write_lock:
+            while view and self._device_alive:
+                try:
+                    view = view[os.write(self._master, view):]
+                except BlockingIOError:
+                    select.select([], [self._master], [], 0.1)
+
+    def send_lines(self, lines):
+        """Write each line followed by the terminator."""
+        for index, line in enumerate(lines):
+            if index and self._line_delay:
+                time.sleep(self._line_delay)
+            if isinstance(line, str):
+                line = bytes(line, 'utf-8')
+            self.send(line + self._terminator)
+
+    def stream(self, lines, rate=None, burst=1, repeat=1):
+        """Send lines from a background thread at a given line rate.
+
+        Args:
+          lines: The list of str or bytes lines.
+          rate: The lines per second, default as fast as possible.
+          burst: The number of lines sent back to back each time.
+          repeat: The number of times the lines are sent.
+        Returns:
+          thread: The started thread, join it to wait for the end.
+        Raises:
+          None
+        """
+        lines = [bytes(line, 'utf-8') if isinstance(line, str) else line
+                 for line in lines]
+        thread = threading.Thread(target=self._stream,
+                                  args=(lines, rate, burst, repeat),
+                                  name='VirtualDevice_Stream')
+        thread.daemon = True
+        self._stream_threads.append(thread)
+        thread.start()
+
+        return thread
+
+    def firmware(self):
+        """Thread function, answering the commands written to the port."""
+        pending = b''
+        while self._device_alive:
+            readable, _, _ = select.select([self._master, self._wakeup[0]],
+                                           [], [])
+            if self._master not in readable:
+                continue
+            try:
+                pending += os.read(self._master, 65536)
+            except OSError:
+                continue
+
+            *commands, pending = pending.split(b'\n')
+            for command in commands:
+                self._handle(str(command, 'utf-8', 'ignore').rstrip('\r'))
+
+    def _handle(self, command):
+        """Answer one received command."""
+        self._received.append(command)
+        if self._echo:
+            self.send_lines([command])
+
+        for pattern, response in self._responses:
+            matched = pattern.search(command)
+            if not matched:
+                continue
+            if callable(response):
+                response = response(command, matched)
+            if self._response_delay:
+                time.sleep(self._response_delay)
+            if isinstance(response, (str, bytes)):
+                response = [response]
+            self.send_lines(response or [])
+            break
+
+        if self._prompt:
+            self.send(self._prompt)
+
+    def _stream(self, lines, rate, burst, repeat):
+        """Thread function of stream."""
+        chunk = self._terminator.join(lines) + self._terminator
+        chunks = [self._terminator.join(lines[index:index + burst]) +
+                  self._terminator for index in range(0, len(lines), burst)]
+        interval = burst / rate if rate else 0
+        next_time = time.monotonic()
+        for _ in range(repeat):
+            if not interval:
+                if not self._device_alive:
+                    return
+                self.send(chunk)
+                continue
+            for data in chunks:
+                if not self._device_alive:
+                    return
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.send(data)
+                next_time += interval
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is a wire trace module.
+
+This module has a class used to keep the latest bytes a Serial read and
+wrote in memory, for dumping when something goes wrong. Records go into a
+preallocated ring, so tracing costs a copy and no formatting, and a Serial
+without a trace only tests for None.
+
+"""
+
+import struct
+import threading
+import time
+
+from db_com.communications.recorder import DIRECTION_RX, DIRECTION_TX
+
+TRACE_SIZE = 1024 * 1024
+TRACE_RECORDS = 65536
+DIRECTION_NAMES = {DIRECTION_RX: 'RX', DIRECTION_TX: 'TX'}
+
+# Time, direction, start and length of a record.
+_SLOT = struct.Struct('<dBqq')
+
+
+class WireTrace(object):
+    """Class keeps the latest records of Serial traffic in a ring.
+
+    Set an instance as Serial.trace to enable tracing, None to disable it.
+    """
+
+    def __init__(self, size=TRACE_SIZE, max_records=TRACE_RECORDS):
+        """Configure the trace initial values.
+
+        Args:
+          size: The bytes of data kept.
+          max_records: The records kept.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        self._data = bytearray(size)
+        self._size = size
+        self._slots = bytearray(_SLOT.size * max_records)
+        self._max_records = max_records
+        # Totals since clear, the ring positions are taken modulo the size.
+        self._count = 0
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self._max_records)
+
+    def clear(self):
+        """Drop all records."""
+        with self._lock:
+            self._count = 0
+            self._written = 0
+
+    def record(self, data, direction=DIRECTION_RX):
+        """Add a record, called from the Serial threads.
+
+        Args:
+          data: The bytes or memoryview transferred.  Only the last size
+            bytes of larger data are kept.
+          direction: DIRECTION_RX or DIRECTION_TX.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        size = self._size
+        length = len(data)
+        with self._lock:
+            if length > size:
+                data = data[length - size:]
+                self._written += length - size
+                length = size
+
+            written = self._written
+            start = written % size
+            if start + length <= size:
+                self._data[start:start + length] = data
+            else:
+                head = size - start
+                self._data[start:] = data[:head]
+                self._data[:length - head] = data[head:]
+
+            _SLOT.pack_into(self._slots,
+                            self._count % self._max_records * _SLOT.size,
+                            time.time(), direction, written, length)
+            self._written = written + length
+            self._count += 1
+
+    def dump(self):
+        """Return the records still held, oldest first.
+
+        Returns:
+          List of (time, direction, bytes) tuples.  A record partly
+            overwritten by newer data keeps only its newest bytes.
+        """
+        records = []
+        with self._lock:
+            size = self._size
+            oldest = self._written - size
+            for number in range(self._count - len(self), self._count):
+                timestamp, direction, start, length = _SLOT.unpack_from(
+                    self._slots, number % self._max_records * _SLOT.size)
+                end = start + length
+                if end <= oldest:
+                    continue
+                start = max(start, oldest)
+                begin = start % size
+                if begin + end - start <= size:
+                    data = bytes(self._data[begin:begin + end - start])
+                else:
+                    data = bytes(self._data[begin:]) + \
+                        bytes(self._data[:end - start - (size - begin)])
+                records.append((timestamp, direction, data))
+
+        return records
+
+    def dump_text(self, stream):
+        """Write the records still held to a text stream, one per line.
+
+        Args:
+          stream: The file-like object to write to.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        for timestamp, direction, data in self.dump():
+            stream.write('{}.{:06d} {} {!r}\n'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+                int(timestamp % 1 * 1000000), DIRECTION_NAMES[direction],
+                data))
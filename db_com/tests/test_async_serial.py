@@ -0,0 +1,117 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This is the AsyncSerial test module.
+
+This module checks that AsyncSerial reads framed and filtered data the same
+way as Serial, over a VirtualDevice pty.
+
+  $ python -m unittest db_com.tests.test_async_serial
+
+"""
+
+import asyncio
+import unittest
+
+from db_com.communications.async_serial import AsyncSerial
+from db_com.communications.checksum import ChecksumStage
+from db_com.communications.db_serial import Serial
+from db_com.communications.framers import SlipFramer
+from db_com.communications.virtual_device import VirtualDevice
+
+
+class AsyncSerialFramingTest(unittest.TestCase):
+    """Class compares AsyncSerial and Serial with a SLIP framer and a CRC16
+    checksum stage."""
+
+    def setUp(self):
+        self._device = VirtualDevice()
+        self._device.open()
+        self._stage = ChecksumStage('crc16')
+
+    def tearDown(self):
+        self._device.close()
+
+    def _send(self, *payloads, bad=None):
+        """Send SLIP frames of payloads with their CRC, and bad as a frame
+        with a wrong CRC."""
+        data = b''.join(SlipFramer.encode(self._stage.append(payload))
+                        for payload in payloads)
+        if bad is not None:
+            data = SlipFramer.encode(bad + b'\x00\x00') + data
+        self._device.send(data)
+
+    def _run(self, coroutine_function):
+        """Run coroutine_function with an open AsyncSerial."""
+        async def run():
+            serial_port = AsyncSerial(self._device.port, 115200,
+                                      bytes_mode=True, framer=SlipFramer(),
+                                      frame_filter=ChecksumStage('crc16'))
+            await serial_port.open()
+            try:
+                return await coroutine_function(serial_port)
+            finally:
+                serial_port.close()
+
+        return asyncio.run(run())
+
+    def _serial(self):
+        """Return an open Serial configured as the AsyncSerial."""
+        serial_port = Serial(self._device.port, 115200, bytes_mode=True,
+                             framer=SlipFramer(),
+                             frame_filter=ChecksumStage('crc16'))
+        serial_port.open(start_reader=False)
+        self.addCleanup(serial_port.close)
+        return serial_port
+
+    def test_read_strips_checksum_and_drops_bad_frames(self):
+        async def read(serial_port):
+            self._send(b'hello', bad=b'bad!!')
+            return await serial_port.read(timeout=1)
+
+        self.assertEqual(self._run(read), b'hello')
+
+    def test_read_matches_serial(self):
+        serial_port = self._serial()
+        self._send(b'hello', bad=b'bad!!')
+        self.assertEqual(serial_port.read(timeout=1), b'hello')
+
+    def test_read_timeout_returns_empty(self):
+        async def read(serial_port):
+            self._device.send(SlipFramer.encode(b'x')[:-1])
+            return await serial_port.read(timeout=0.1)
+
+        self.assertEqual(self._run(read), b'')
+
+    def test_read_until_returns_frames(self):
+        async def read_until(serial_port):
+            self._send(b'x1', b'PROMPT', b'after')
+            frames = await serial_port.read_until('PROMPT', timeout=1)
+            return frames, await serial_port.read(timeout=1)
+
+        frames, after = self._run(read_until)
+        self.assertEqual(frames, [b'x1', b'PROMPT'])
+        self.assertEqual(after, b'after')
+
+    def test_read_until_matches_serial(self):
+        serial_port = self._serial()
+        self._send(b'x1', b'PROMPT', b'after')
+        self.assertEqual(serial_port.read_until('PROMPT', timeout=1),
+                         [b'x1', b'PROMPT'])
+        self.assertEqual(serial_port.read(timeout=1), b'after')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+line_batcher.py:
+    Bridge coalescing received lines from the read thread to the GUI.
+"""
+
+import time
+from collections import deque
+
+from PySide2 import QtCore
+
+FLUSH_INTERVAL = 16
+BATCH_SIZE = 1000
+
+
+class LineBatcher(QtCore.QObject):
+    """Collect lines from any thread and deliver them to the GUI thread in
+    batches, once per flush interval or when batch_size lines are waiting.
+
+    push only appends to a deque, which is safe without a lock.
+    """
+    ready_batch = QtCore.Signal(list)
+    _flush_requested = QtCore.Signal()
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE,
+                 parent=None):
+        super(LineBatcher, self).__init__(parent)
+        self._lines = deque()
+        self._batch_size = batch_size
+        self._flush_pending = False
+        self._batches = 0
+        self._flushed_lines = 0
+        self._max_batch = 0
+        self._last_flush_time = 0.0
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(flush_interval)
+        self._timer.timeout.connect(self.flush)
+        self._flush_requested.connect(self.flush, QtCore.Qt.QueuedConnection)
+        self._timer.start()
+
+    @property
+    def flush_interval(self):
+        """Flush interval in milliseconds."""
+        return self._timer.interval()
+
+    @flush_interval.setter
+    def flush_interval(self, value):
+        self._timer.setInterval(value)
+
+    @property
+    def batch_size(self):
+        """Number of waiting lines which triggers a flush before the timer."""
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, value):
+        self._batch_size = value
+
+    def metrics(self):
+        """Return dict of batching metrics.
+
+        Args:
+          None.
+        Returns:
+          dict of waiting lines, batches and lines flushed, largest batch and
+            duration of the last flush in seconds.
+        Raises:
+          None
+        """
+        return {'waiting': len(self._lines), 'batches': self._batches,
+                'lines': self._flushed_lines, 'max_batch': self._max_batch,
+                'last_flush_time': self._last_flush_time}
+
+    def push(self, line):
+        """Read handler, queue a line for the next batch."""
+        self._lines.append(line)
+        if len(self._lines) >= self._batch_size and not self._flush_pending:
+            self._flush_pending = True
+            self._flush_requested.emit()
+
+    @QtCore.Slot()
+    def flush(self):
+        """Slot, deliver every waiting line as one batch."""
+        self._flush_pending = False
+        count = len(self._lines)
+        if not count:
+            return
+
+        start_time = time.monotonic()
+        popleft = self._lines.popleft
+        batch = [popleft() for _ in range(count)]
+        self.ready_batch.emit(batch)
+
+        self._batches += 1
+        self._flushed_lines += count
+        if count > self._max_batch:
+            self._max_batch = count
+        self._last_flush_time = time.monotonic() - start_time
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+line_store.py:
+    Bounded store of terminal lines in a preallocated byte arena.
+"""
+
+from array import array
+
+MAX_LINES = 100000
+ARENA_SIZE = 16 * 1024 * 1024
+
+
+class LineStore(object):
+    """Keep the newest lines in a fixed-size byte arena.
+
+    Lines are written one after another into the arena, wrapping to its
+    start, and their start and end offsets are kept in two fixed-size ring
+    arrays. Appending evicts the oldest lines when either the line count or
+    the arena is full, so memory stays constant and append is O(1).
+    """
+
+    def __init__(self, max_lines=MAX_LINES, arena_size=ARENA_SIZE):
+        self._arena = bytearray(arena_size)
+        self._starts = array('q', bytes(8 * max_lines))
+        self._ends = array('q', bytes(8 * max_lines))
+        self._max_lines = max_lines
+        self._first = 0
+        self._count = 0
+        self._write = 0
+        self._dropped = 0
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, row):
+        """Line at row, 0 being the oldest kept, as bytes."""
+        if row < 0:
+            row += self._count
+        if not 0 <= row < self._count:
+            raise IndexError('LineStore row out of range')
+        index = (self._first + row) % self._max_lines
+        return bytes(self._arena[self._starts[index]:self._ends[index]])
+
+    @property
+    def max_lines(self):
+        """The scrollback cap in lines."""
+        return self._max_lines
+
+    @property
+    def dropped(self):
+        """Number of lines evicted since the store was created."""
+        return self._dropped
+
+    def text(self, row):
+        """Line at row as str."""
+        return str(self[row], 'utf-8', 'replace')
+
+    def clear(self):
+        """Drop every line."""
+        self._first = 0
+        self._count = 0
+        self._write = 0
+
+    def append(self, line):
+        """Append a line, evicting the oldest ones if needed.
+
+        Args:
+          line: The str or bytes line.  Lines longer than the arena are
+            truncated.
+        Returns:
+          evicted: Number of lines evicted.
+        Raises:
+          None
+        """
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        size = min(len(line), len(self._arena))
+
+        self._first, self._count, start, evicted = self._make_room(
+            size, self._first, self._count, self._write, self._bounds)
+        end = start + size
+        self._arena[start:end] = line[:size]
+        index = (self._first + self._count) % self._max_lines
+        self._starts[index] = start
+        self._ends[index] = end
+        self._count += 1
+        self._write = end
+        self._dropped += evicted
+
+        return evicted
+
+    def evictions(self, lines):
+        """Number of lines appending lines would evict, without appending
+        them, so a model can announce the change first.
+
+        Args:
+          lines: The list of str or bytes lines.
+        Returns:
+          evicted: Number of lines evicted, lines of the batch included.
+        Raises:
+          None
+        """
+        first, count, write = self._first, self._count, self._write
+        added = {}
+
+        def bounds(index):
+            if index in added:
+                return added[index]
+            return self._starts[index], self._ends[index]
+
+        evicted = 0
+        for line in lines:
+            if isinstance(line, str):
+                line = line.encode('utf-8')
+            size = min(len(line), len(self._arena))
+            first, count, start, dropped = self._make_room(
+                size, first, count, write, bounds)
+            added[(first + count) % self._max_lines] = (start, start + size)
+            count += 1
+            write = start + size
+            evicted += dropped
+
+        return evicted
+
+    def _make_room(self, size, first, count, write, bounds):
+        """Evict the oldest lines of the ring state (first, count, write)
+        until a line of size bytes fits.
+
+        Returns:
+          (first, count, start, evicted): The new ring state, the arena
+            offset of the line and the number of lines evicted.
+        """
+        evicted = 0
+        if write + size > len(self._arena):
+            # Wrap to the start, the lines left at the end are the oldest.
+            while count and bounds(first)[0] >= write:
+                first = (first + 1) % self._max_lines
+                count -= 1
+                evicted += 1
+            write = 0
+        start, end = write, write + size
+
+        while count and (count == self._max_lines or
+                         self._overlaps(bounds(first), start, end)):
+            first = (first + 1) % self._max_lines
+            count -= 1
+            evicted += 1
+
+        return first, count, start, evicted
+
+    def _bounds(self, index):
+        """Arena range (start, end) of the line at ring index."""
+        return self._starts[index], self._ends[index]
+
+    @staticmethod
+    def _overlaps(bounds, start, end):
+        """Whether the line of arena range bounds lies in [start, end)."""
+        line_start, line_end = bounds
+        return line_start < end and (line_end > start or line_start >= start)
@@ -26,6 +26,7 @@ from PySide2.QtUiTools import QUiLoader
 from PySide2.QtWidgets import QListView, QListWidget, QListWidgetItem
 from PySide2.QtWidgets import QStatusBar, QWidget
 
+from db_com.user_interface.stats_label import PortStatsLabel
 from db_com.user_interface.utilities_widget import UtilWidget
 
 __copyright__ = 'Copyright © 2020 DekBan - All Right Reserved.'
@@ -36,6 +37,7 @@ class MainWindow(QObject):
         super(MainWindow, self).__init__()
         self._window = None
         self._option_panel = None
+        self._stats_label = None
         self._pages = OrderedDict()
 
         self.ui_setup()
@@ -77,6 +79,9 @@ class MainWindow(QObject):
 
         self._window.widget_stack.setCurrentIndex(0)
 
+        self._stats_label = PortStatsLabel(self._pages['item'].serial)
+        status_bar.addPermanentWidget(self._stats_label)
+
         # Build up signal / slot
         self._option_panel.currentItemChanged.connect(self.set_page)
 
@@ -28,6 +28,7 @@ from PySide2.QtWidgets import QComboBox, QPushButton
 from PySide2.QtWidgets import QTreeWidget, QTreeWidgetItem
 
 from db_com.communications.db_serial import Serial
+from db_com.communications.port_registry import PortRegistry
 
 TITLE_COLOR = '#0066cc'
 TXT_COLOR = '#eeeeee'
@@ -37,6 +38,9 @@ COMBO_BOX_STYLE = 'background: #eeeeee;; color: #2d2d2d'
 
 
 class SerialPanel(QTreeWidget):
+    port_added = QtCore.Signal(str)
+    port_removed = QtCore.Signal(str)
+
     def __init__(self, parent=None):
         super(SerialPanel, self).__init__(parent)
         self._title = None
@@ -49,9 +53,21 @@ class SerialPanel(QTreeWidget):
         self._items = OrderedDict()
         self._combo_boxes = OrderedDict()
 
+        self._registry = PortRegistry(
+            added_handler=lambda port: self.port_added.emit(port.device),
+            removed_handler=self.port_removed.emit)
+
         self.ui_setup()
 
         self._refresh_button.clicked.connect(self.refresh_ports)
+        self.port_added.connect(self.add_port)
+        self.port_removed.connect(self.remove_port)
+        self._registry.start()
+        # The watcher thread emits into the panel, so it is stopped before
+        # the application quits or the panel is deleted.
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(
+            self._registry.stop)
+        self.destroyed.connect(self._registry.stop)
 
     @property
     def open_button(self):
@@ -87,9 +103,6 @@ class SerialPanel(QTreeWidget):
         self._items['port'].setTextColor(0, QColor(TITLE_COLOR))
         self._items['port'].setBackgroundColor(0, QColor(ODD_COLOR))
         self._items['port'].setBackgroundColor(1, QColor(ODD_COLOR))
-        for port in Serial.list_ports():
-            if port.name:
-                self._combo_boxes['port'].addItem(port.name, port.device)
 
         self._items['baud'].setText(0, 'BaudRate')
         self._items['baud'].setTextColor(0, QColor(TITLE_COLOR))
@@ -152,10 +165,18 @@ class SerialPanel(QTreeWidget):
         self.setItemWidget(opt_item, 1, self._close_button)
         self.setItemWidget(opt_item, 0, self._open_button)
 
+    @property
+    def registry(self):
+        return self._registry
+
     @QtCore.Slot()
     def refresh_ports(self):
         """Slot to refresh serial port name list.
 
+        The list is filled from the port registry cache at once, and a
+        rescan is requested from the registry thread, which adds and removes
+        ports through signals when it is done.
+
         Args:
           None.
         Returns:
@@ -166,9 +187,28 @@ class SerialPanel(QTreeWidget):
         logging.debug('Refresh ports')
         self._combo_boxes['port'].clear()
 
-        for port in Serial.list_ports():
-            if port.device:
-                self._combo_boxes['port'].addItem(port.device, port.device)
+        for port in self._registry.ports():
+            self.add_port(port.device)
+        self._registry.request_scan()
+
+    @QtCore.Slot(str)
+    def add_port(self, device):
+        """Slot to add a port to the name list, in order."""
+        combo_box = self._combo_boxes['port']
+        if combo_box.findData(device) != -1:
+            return
+        index = 0
+        while index < combo_box.count() and \
+                combo_box.itemData(index) < device:
+            index += 1
+        combo_box.insertItem(index, device, device)
+
+    @QtCore.Slot(str)
+    def remove_port(self, device):
+        """Slot to remove a port from the name list."""
+        index = self._combo_boxes['port'].findData(device)
+        if index != -1:
+            self._combo_boxes['port'].removeItem(index)
 
     def port_kwargs(self):
         """Return dict of current serial port setup.
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+stats_label.py:
+    Compact live view of the I/O statistics of a serial port.
+"""
+
+import time
+
+from PySide2 import QtCore
+from PySide2.QtWidgets import QLabel
+
+UPDATE_INTERVAL = 500
+
+
+class PortStatsLabel(QLabel):
+    """Show the rates, query latency and errors of a Serial, for the status
+    bar.  Statistics are polled from the GUI thread with a lock-free
+    snapshot, so the label never waits for the port threads.
+    """
+
+    def __init__(self, serial=None, update_interval=UPDATE_INTERVAL,
+                 parent=None):
+        super(PortStatsLabel, self).__init__(parent)
+        self._serial = serial
+        self._last = None
+        self._last_time = 0.0
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(update_interval)
+        self._timer.timeout.connect(self.update_stats)
+        self._timer.start()
+
+    @property
+    def serial(self):
+        return self._serial
+
+    @serial.setter
+    def serial(self, value):
+        self._serial = value
+        self._last = None
+
+    @QtCore.Slot()
+    def update_stats(self):
+        """Slot, show the rates since the last update."""
+        if self._serial is None:
+            self.clear()
+            return
+
+        now = time.monotonic()
+        stats = self._serial.statistics()
+        last, elapsed = self._last, now - self._last_time
+        self._last, self._last_time = stats, now
+        if last is None or elapsed <= 0:
+            return
+
+        latency = stats['query_latency']
+        self.setText(
+            'RX {:.1f} kB/s {:.0f} l/s | TX {:.1f} kB/s | '
+            'query p50 {:.1f} ms p99 {:.1f} ms | queue {} | errors {}'.format(
+                (stats['bytes_in'] - last['bytes_in']) / elapsed / 1000,
+                (stats['lines_in'] - last['lines_in']) / elapsed,
+                (stats['bytes_out'] - last['bytes_out']) / elapsed / 1000,
+                latency['p50'] * 1000, latency['p99'] * 1000,
+                stats['queue_depth'], stats['framing_errors']))
+        self.setToolTip(
+            'Reads {reads}  Writes {writes}  Lines in {lines_in}  '
+            'Lines out {lines_out}  Handler time {handler_time:.3f} s'.format(
+                **stats))
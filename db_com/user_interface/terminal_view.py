@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#
+# Copyright © 2020 DekBan - All Right Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+terminal_view.py:
+    Read-only terminal view rendering only the visible rows of a LineStore.
+"""
+
+from PySide2 import QtCore
+from PySide2.QtCore import QAbstractListModel, QModelIndex, Qt
+from PySide2.QtGui import QPalette, QFontDatabase
+from PySide2.QtWidgets import QAbstractItemView, QListView
+
+from db_com.user_interface.line_store import LineStore, MAX_LINES, ARENA_SIZE
+
+
+class TerminalModel(QAbstractListModel):
+    """List model over a LineStore, one row per line."""
+
+    def __init__(self, store, parent=None):
+        super(TerminalModel, self).__init__(parent)
+        self._store = store
+        self._rows = len(store)
+
+    @property
+    def store(self):
+        return self._store
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._rows
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        if index.row() >= len(self._store):
+            return None
+        return self._store.text(index.row())
+
+    def append_lines(self, lines):
+        """Append lines to the store and notify the views.
+
+        Args:
+          lines: List of str or bytes lines.
+        Returns:
+          None
+        Raises:
+          None
+        """
+        if not lines:
+            return
+
+        # The rows changed are announced before the store is changed.  The
+        # oldest lines go first, so unless every row is evicted the new
+        # lines are all kept.
+        lines = [line.encode('utf-8') if isinstance(line, str) else line
+                 for line in lines]
+        evicted = self._store.evictions(lines)
+        if evicted >= self._rows:
+            self.beginResetModel()
+            self._append(lines)
+            self._rows = len(self._store)
+            self.endResetModel()
+            return
+
+        if evicted:
+            # The rows left are the ones after the evicted rows, the new
+            # rows stay hidden past rowCount until they are inserted.
+            self.beginRemoveRows(QModelIndex(), 0, evicted - 1)
+            self._append(lines)
+            self._rows -= evicted
+            self.endRemoveRows()
+            self.beginInsertRows(QModelIndex(), self._rows,
+                                 self._rows + len(lines) - 1)
+        else:
+            self.beginInsertRows(QModelIndex(), self._rows,
+                                 self._rows + len(lines) - 1)
+            self._append(lines)
+        self._rows = len(self._store)
+        self.endInsertRows()
+
+    def _append(self, lines):
+        """Append lines to the store."""
+        append = self._store.append
+        for line in lines:
+            append(line)
+
+    def clear(self):
+        """Drop every line."""
+        self.beginResetModel()
+        self._store.clear()
+        self._rows = 0
+        self.endResetModel()
+
+
+class TerminalView(QListView):
+    """Terminal look list view with a bounded scrollback.
+
+    All rows have the same height, so the view lays out and paints only the
+    visible rows whatever the number of lines.
+    """
+
+    def __init__(self, max_lines=MAX_LINES, arena_size=ARENA_SIZE,
+                 parent=None):
+        super(TerminalView, self).__init__(parent)
+        self._model = TerminalModel(LineStore(max_lines, arena_size), self)
+
+        palette = QPalette()
+        palette.setColor(QPalette.Base, QtCore.Qt.black)
+        palette.setColor(QPalette.Text, QtCore.Qt.green)
+
+        self.setModel(self._model)
+        self.setUniformItemSizes(True)
+        self.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.setPalette(palette)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+
+    @property
+    def max_lines(self):
+        """The scrollback cap in lines."""
+        return self._model.store.max_lines
+
+    def append_lines(self, lines):
+        """Append lines, following the output if scrolled to the bottom."""
+        scroll_bar = self.verticalScrollBar()
+        follow = scroll_bar.value() == scroll_bar.maximum()
+        self._model.append_lines(lines)
+        if follow:
+            self.scrollToBottom()
+
+    def append(self, line):
+        """Append one line, like QTextEdit.append."""
+        self.append_lines([line])
+
+    def clear(self):
+        """Drop every line."""
+        self._model.clear()
@@ -20,20 +20,28 @@ utilities_widget.py:
 """
 
 import logging
-
+import os
+import queue
 
 from PySide2 import QtCore
-from PySide2.QtGui import QPalette, QFontDatabase
 from PySide2.QtWidgets import QWidget
 from PySide2.QtWidgets import QVBoxLayout, QHBoxLayout
-from PySide2.QtWidgets import QLabel, QTextEdit, QLineEdit, QPushButton
+from PySide2.QtWidgets import QLabel, QLineEdit, QPushButton
 
+from db_com.user_interface.line_batcher import LineBatcher
 from db_com.user_interface.serial_panel import SerialPanel
+from db_com.user_interface.terminal_view import TerminalView
 from db_com.communications.db_serial import Serial
+from db_com.communications.recorder import Recorder
+from db_com.communications.serial_writer import SerialWriter
+
+WRITE_QUEUE_SIZE = 256
+SCROLLBACK_LINES = 100000
+CAPTURE_DIRECTORY = os.path.join(os.path.expanduser('~'), 'db_com_captures')
 
 
 class QSerial(QtCore.QObject):
-    ready_read = QtCore.Signal(str)
+    write_done = QtCore.Signal(str, float, str)
 
 
 class UtilWidget(QWidget, QtCore.QObject):
@@ -45,38 +53,39 @@ class UtilWidget(QWidget, QtCore.QObject):
         self._reader_alive = None
         self._reader_thread = None
         self._serial_panel = SerialPanel()
-        self._serial_recv_box = QTextEdit()
+        self._serial_recv_box = TerminalView(max_lines=SCROLLBACK_LINES)
         self._serial_send_box = QLineEdit()
         self._send_button = QPushButton('Send')
+        self._record_button = QPushButton('Record')
 
         self._ui_setup()
         self._serial_panel.refresh_ports()
 
         self._qserial = QSerial()
+        self._batcher = LineBatcher(parent=self)
 
         self._send_button.clicked.connect(self.send_command)
+        self._record_button.toggled.connect(self.record)
         self._serial_panel.open_button.clicked.connect(self.open_port)
         self._serial_panel.close_button.clicked.connect(self.close_port)
-        self._qserial.ready_read.connect(self.read_handler)
+        self._batcher.ready_batch.connect(self.read_handler)
+        self._qserial.write_done.connect(self.write_done)
 
         self._serial = Serial('', '115200', read_handler=self.ready_read)
+        self._writer = SerialWriter(self._serial,
+                                    done_handler=self._emit_write_done,
+                                    maxsize=WRITE_QUEUE_SIZE)
+        self._recorder = Recorder(CAPTURE_DIRECTORY)
 
     def _ui_setup(self):
         """Initialize user interface, and set color, size, alignment .etc."""
-        cmd_palette = QPalette()
-        font = QFontDatabase.systemFont(QFontDatabase.FixedFont)
-        cmd_palette.setColor(QPalette.Base, QtCore.Qt.black)
-        cmd_palette.setColor(QPalette.Text, QtCore.Qt.green)
-
-        self._serial_recv_box.setFont(font)
-        self._serial_recv_box.setReadOnly(True)
-        self._serial_recv_box.setPalette(cmd_palette)
-
         self._send_button.setEnabled(False)
+        self._record_button.setCheckable(True)
 
         cmd_layout = QHBoxLayout()
         cmd_layout.addWidget(self._serial_send_box)
         cmd_layout.addWidget(self._send_button)
+        cmd_layout.addWidget(self._record_button)
 
         self._main_layout = QVBoxLayout(self)
         self._main_layout.addWidget(self._title)
@@ -86,13 +95,21 @@ class UtilWidget(QWidget, QtCore.QObject):
 
         self.setLayout(self._main_layout)
 
+    @property
+    def serial(self):
+        return self._serial
+
     @property
     def serial_recv_box(self):
         return self._serial_recv_box
 
     @property
     def ready_read(self):
-        return self._qserial.ready_read.emit
+        return self._batcher.push
+
+    @property
+    def batcher(self):
+        return self._batcher
 
     @QtCore.Slot()
     def open_port(self):
@@ -124,6 +141,7 @@ class UtilWidget(QWidget, QtCore.QObject):
 
         try:
             self._serial.open()
+            self._writer.start()
             self._send_button.setEnabled(True)
             self._serial_panel.open_button.setEnabled(False)
             self._serial_panel.close_button.setEnabled(True)
@@ -137,14 +155,54 @@ class UtilWidget(QWidget, QtCore.QObject):
         self._serial_panel.close_button.setEnabled(False)
         self._send_button.setEnabled(False)
 
+        self._writer.stop(timeout=0)
         self._serial.close()
         logging.debug('Serial port closed')
 
+    @QtCore.Slot(bool)
+    def record(self, checked):
+        """Slot to start or stop recording the serial traffic to disk."""
+        if checked:
+            self._recorder.start()
+            self._serial.recorder = self._recorder
+            self._record_button.setToolTip(
+                'Recording to {}'.format(CAPTURE_DIRECTORY))
+            return
+
+        self._serial.recorder = None
+        self._recorder.stop()
+        metrics = self._recorder.metrics()
+        self._record_button.setToolTip(
+            'Recorded {} bytes in {} segments, {} records dropped'.format(
+                metrics['bytes'], metrics['segments'],
+                metrics['dropped_items']))
+
     @QtCore.Slot()
     def send_command(self):
-        """Slot to send command trough serial port."""
-        self._serial.write(self._serial_send_box.text())
+        """Slot to queue command to the writer thread of serial port."""
+        try:
+            self._writer.send(self._serial_send_box.text())
+        except queue.Full:
+            logging.warning('Write queue full, command dropped.')
+
+    def _emit_write_done(self, command, latency, error):
+        """Writer thread handler, forward write completion to Qt."""
+        self._qserial.write_done.emit(command, latency,
+                                      '' if error is None else str(error))
+
+    @QtCore.Slot(str, float, str)
+    def write_done(self, command, latency, error):
+        """Slot, report a completed write and the writer metrics."""
+        if error:
+            logging.warning('Write {} failed : {}'.format(command, error))
+            return
 
-    @QtCore.Slot()
-    def read_handler(self, data):
-        self._serial_recv_box.append(data)
+        metrics = self._writer.metrics()
+        self._send_button.setToolTip(
+            'Queued: {}  Last write: {:.1f} ms  Max: {:.1f} ms'.format(
+                metrics['queue_depth'], latency * 1000,
+                metrics['max_latency'] * 1000))
+
+    @QtCore.Slot(list)
+    def read_handler(self, lines):
+        self._serial_recv_box.append_lines(lines)